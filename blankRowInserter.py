@@ -13,60 +13,303 @@
 # 
 # Nadia Borsch      misc@nborsch.com        Jun/2018
 
-import openpyxl, os
+import bisect
+import os
+import re
+import sys
 
-print(f"\n{'Blank Row Inserter':>35}")
-print(f"{'===== === ========':>35}")
+import openpyxl
+from openpyxl.formula.tokenizer import Token
+from openpyxl.formula.tokenizer import Tokenizer
+from openpyxl.formula.tokenizer import TokenizerError
+from openpyxl.worksheet.formula import ArrayFormula
 
-print(f"\nCurrent working directory is {os.getcwd()}.")
+from spreadsheetIO import copy_layout
+from spreadsheetIO import copy_style
+from spreadsheetIO import copy_workbook_settings
+from spreadsheetIO import open_workbook
+from spreadsheetIO import read_layouts
+from spreadsheetIO import read_worksheet
+from spreadsheetIO import save_workbook
 
-while True:
-    workbook = input("Please enter the name of the spreadsheet file to which the rows will be inserted:\n")
-    if workbook.endswith(".xlsx"):
-        break
+# Constants
+# A cell, row or column reference, optionally on another sheet
+REFERENCE_RE = re.compile(
+    r"^(?:(?P<sheet>'(?:[^']|'')+'|[^'!]+)!)?"
+    r"(?P<start>\$?[A-Za-z]{0,3}\$?\d*)"
+    r"(?::(?P<end>\$?[A-Za-z]{0,3}\$?\d*))?$")
+ROW_NUMBER_RE = re.compile(r"\d+$")
+DIGITS_RE = re.compile(r"(\d+)")
+# Sheet name in front of a reference, which can hold digits of its own
+SHEET_NAME_RE = re.compile(r"(?:'(?:[^']|'')*'|[\w.]+)!")
+
+
+def insert_rows(workbook, edits):
+    """
+    Inserts blank rows in the active sheet of a workbook in a single pass,
+    and saves it over the workbook. The sheet is read in read-only mode and
+    its rows are written straight into a write-only workbook, adding the
+    blank rows along the way. Cell styles, column widths and merged cells
+    are kept, and formula references and merged ranges are moved down with
+    the rows they point to, including references from other sheets. The rest
+    of each sheet's layout and the defined names are kept too, and the
+    workbook is left untouched if it has parts that can't be copied, such as
+    charts or comments. The edited sheet becomes the first sheet and the
+    other sheets are copied after it. Takes in the workbook filename and a
+    list of (row, count) tuples, each inserting count blank rows right after
+    the given row of the original sheet (0 inserts them at the top).
+    """
+
+    inserted = {}
+    for row, count in edits:
+        if row < 0 or count < 0:
+            raise ValueError(f"can't insert {count} rows after row {row}")
+        inserted[row] = inserted.get(row, 0) + count
+
+    positions = sorted(inserted)
+    shifts = []
+    for row in positions:
+        shifts.append((shifts[-1] if shifts else 0) + inserted[row])
+
+    def shift_row(row):
+        # Rows move down by the blank rows inserted above them
+        index = bisect.bisect_left(positions, row)
+        return row + shifts[index - 1] if index else row
+
+    new_wb = openpyxl.Workbook(write_only=True)
+    styles = {}
+
+    with open_workbook(workbook) as wb:
+        edited_title = wb.active.title
+        sheet_names = [edited_title] + [
+            sheet_name for sheet_name in wb.sheetnames
+            if sheet_name != edited_title]
+
+        # Every layout is read first so that the workbook is left as it is
+        # if any part of it would be lost
+        layouts = read_layouts(workbook, sheet_names)
+
+        templates = {}
+        copy_workbook_settings(wb, new_wb, lambda formula: shift_formula(
+            formula, False, edited_title, shift_row, templates))
+
+        for sheet_name in sheet_names:
+            print(f"Working through sheet {sheet_name}...")
+            copy_sheet(
+                wb[sheet_name], new_wb.create_sheet(sheet_name),
+                layouts.pop(sheet_name), styles, edited_title, shift_row,
+                inserted if sheet_name == edited_title else {})
+
+    print("Saving...")
+    save_workbook(new_wb, workbook)
+
+
+def copy_sheet(
+        sheet, new_sheet, layout, styles, edited_title, shift_row, inserted):
+    """
+    Copies a read-only worksheet into a write-only one row by row, inserting
+    blank rows and moving references to the edited sheet. Takes in the
+    read-only worksheet, the write-only worksheet, the sheet's layout read
+    by read_layout, the dict of styles already copied, the title of the
+    edited sheet, the function that moves a row number of the edited sheet
+    and a dict of blank rows to insert after each row of this sheet.
+    """
+
+    is_edited = sheet.title == edited_title
+    templates = {}
+
+    copy_layout(
+        sheet, new_sheet, layout, styles, shift_row if is_edited else None,
+        lambda formula: shift_formula(
+            formula, is_edited, edited_title, shift_row, templates))
+
+    for _ in range(inserted.get(0, 0)):
+        new_sheet.append([])
+
+    for row_number, row in enumerate(
+            read_worksheet(sheet.parent, sheet.title, values_only=False), 1):
+        new_row = []
+
+        for cell in row:
+            value = cell.value
+
+            if cell.data_type == "f":
+                value = shift_formula(
+                    value, is_edited, edited_title, shift_row, templates)
+
+            new_row.append(copy_style(cell, new_sheet, value, styles))
+
+        new_sheet.append(new_row)
+
+        for _ in range(inserted.get(row_number, 0)):
+            new_sheet.append([])
+
+
+def shift_formula(formula, is_edited, edited_title, shift_row, templates):
+    """
+    Moves the row numbers of a formula's references to the edited sheet.
+    References without a sheet name only point to the edited sheet when the
+    formula is on it. Formulas that only differ by their numbers outside of
+    sheet names, like those filled down a column, are tokenized once. Takes
+    in the formula (text starting with "=" or an ArrayFormula), whether the
+    formula is on the edited sheet, the title of the edited sheet, the
+    function that moves a row number and the dict of formula templates
+    already tokenized, and returns the new formula.
+    """
+
+    if isinstance(formula, ArrayFormula):
+        return ArrayFormula(
+            shift_reference(formula.ref, True, edited_title, shift_row),
+            shift_formula(
+                formula.text, is_edited, edited_title, shift_row, templates))
+
+    if not isinstance(formula, str) or not formula.startswith("="):
+        return formula
+
+    # Text and runs of digits alternate. Sheet names are kept whole, so that
+    # references to Sheet1 and Sheet2 don't share a template
+    parts = DIGITS_RE.split(formula)
+    template = (
+        is_edited, tuple(parts[::2]), tuple(SHEET_NAME_RE.findall(formula)))
+    if template not in templates:
+        templates[template] = row_number_runs(
+            formula, is_edited, edited_title)
+
+    for run in templates[template]:
+        parts[run * 2 + 1] = str(shift_row(int(parts[run * 2 + 1])))
+
+    return "".join(parts)
+
+
+def row_number_runs(formula, is_edited, edited_title):
+    """
+    Finds which runs of digits in a formula are row numbers of references to
+    the edited sheet. Takes in the formula text, whether it's on the edited
+    sheet and the title of the edited sheet, and returns a tuple with the
+    indexes of those runs among all runs of digits in the formula.
+    """
 
-while True:
     try:
-        rows = int(input("\nEnter the number of rows to be inserted:\n"))
-        if rows:
-            break
-    except ValueError:
-        continue
+        tokens = Tokenizer(formula)
+    except TokenizerError:
+        return ()
+
+    runs = []
+    # Tokens hold the whole formula after the "="
+    position = 1
+
+    for token in tokens.items:
+        if token.type == Token.OPERAND and token.subtype == Token.RANGE:
+            for end in reference_rows(token.value, is_edited, edited_title):
+                runs.append(
+                    len(DIGITS_RE.findall(formula[:position + end])) - 1)
+        position += len(token.value)
+
+    return tuple(runs)
+
+
+def reference_rows(reference, is_edited, edited_title):
+    """
+    Finds the row numbers of a single reference to the edited sheet, such as
+    A1, $B$2:C10, 3:5 or 'Some Sheet'!A1. Named ranges and references to
+    other sheets have none. Takes in the reference text, whether it's on the
+    edited sheet and the title of the edited sheet, and returns a list with
+    the position in the reference where each row number ends.
+    """
+
+    match = REFERENCE_RE.match(reference)
+    if not match or not match["start"]:
+        return []
+
+    sheet_name = match["sheet"]
+    if sheet_name is None:
+        if not is_edited:
+            return []
+    elif sheet_name.strip("'").replace("''", "'") != edited_title:
+        return []
+
+    return [
+        match.end(part) for part in ("start", "end")
+        if match[part] and match[part][-1].isdigit()
+        ]
+
+
+def shift_reference(reference, is_edited, edited_title, shift_row):
+    """
+    Moves the row numbers of a single reference to the edited sheet. Takes
+    in the reference text, whether it's on the edited sheet, the title of
+    the edited sheet and the function that moves a row number, and returns
+    the new reference text.
+    """
+
+    for end in reversed(reference_rows(reference, is_edited, edited_title)):
+        start = ROW_NUMBER_RE.search(reference[:end]).start()
+        reference = (
+            reference[:start] + str(shift_row(int(reference[start:end])))
+            + reference[end:])
+
+    return reference
 
-while True:
+
+def main():
+    print(f"\n{'Blank Row Inserter':>35}")
+    print(f"{'===== === ========':>35}")
+
+    if len(sys.argv) > 2:
+        # blankRowInserter.py <N> <M> [<N> <M> ...] <workbook>
+        workbook = sys.argv[-1]
+        try:
+            numbers = [int(number) for number in sys.argv[1:-1]]
+        except ValueError:
+            numbers = []
+
+        if not numbers or len(numbers) % 2:
+            print("\nUsage: blankRowInserter.py <N> <M> [<N> <M> ...] <workbook>")
+            print("Inserts M blank rows after row N, for each pair of whole numbers.")
+            return
+
+        edits = list(zip(numbers[::2], numbers[1::2]))
+
+    else:
+        print(f"\nCurrent working directory is {os.getcwd()}.")
+
+        while True:
+            workbook = input("Please enter the name of the spreadsheet file to which the rows will be inserted:\n")
+            if workbook.endswith(".xlsx"):
+                break
+
+        while True:
+            try:
+                rows = int(input("\nEnter the number of rows to be inserted:\n"))
+                if rows:
+                    break
+            except ValueError:
+                continue
+
+        while True:
+            try:
+                start_from = int(input("\nEnter the row number from which rows will be inserted:\n"))
+                if start_from:
+                    break
+            except ValueError:
+                continue
+
+        edits = [(start_from, rows)]
+
+    for start_from, rows in edits:
+        print(f"{rows} rows will be inserted in the active sheet in {workbook} starting from row {start_from}.")
+    print()
+
+    # Save workbook
     try:
-        start_from = int(input("\nEnter the row number from which rows will be inserted:\n"))
-        if start_from:
-            break
-    except ValueError:
-        continue
-
-print(f"{rows} rows will be inserted in the active sheet in {workbook} starting from row {start_from}.\n")
-
-# Set up workbooks and worksheets
-wb          = openpyxl.load_workbook(workbook)
-sheet       = wb.active
-new_sheet   = wb.create_sheet(f"{sheet.title}", 0)
-
-# Copy the content from rows above and including start_from
-print("Working...")
-for each_row in range(1, start_from + 1):
-    for each_cell in range(1, sheet.max_column + 1):
-        new_sheet.cell(row=each_row, column=each_cell).value = sheet.cell(row=each_row, column=each_cell).value
-
-# Copy the content to the moved cells
-for each_new_row in range(rows + start_from + 1, sheet.max_row + rows + start_from + 1):
-    for each_new_cell in range(1, sheet.max_column + 1):
-        new_sheet.cell(row=each_new_row, column=each_new_cell).value = sheet.cell(row=each_new_row - rows, column=each_new_cell).value
-
-# Delete old worksheet
-wb.remove(sheet)
-
-# Save workbook
-try:
-    print("Saving...")
-    wb.save(f"{workbook}")
-    print("Done.")
+        insert_rows(workbook, edits)
+        print("Done.")
+
+    except PermissionError:
+        print("\nCOULD NOT SAVE SPREADSHEET, PLEASE TRY AGAIN.")
+    except ValueError as error:
+        print(f"\nCOULD NOT INSERT ROWS: {error}.")
+
 
-except PermissionError:
-    print("\nCOULD NOT SAVE SPREADSHEET, PLEASE TRY AGAIN.")
+if __name__ == '__main__':
+    main()
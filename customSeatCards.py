@@ -19,15 +19,37 @@
 #
 # Nadia Borsch      misc@nborsch.com        Jun/2018
 
+import functools
+import io
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from xml.sax.saxutils import escape
+
 from PIL import Image
 from PIL import ImageDraw
 from PIL import ImageFont
+from PIL import TiffImagePlugin
 
 # Constants
 TEMPLATE = "template.jpg"
 COLOR = "black"
 TXT_FONT = ImageFont.truetype("georgia.ttf", 60)
+CARD_WORKERS = os.cpu_count() or 1
+CARD_CHUNKSIZE = 32
+TEXT_CACHE_SIZE = 4096
+BORDER_WIDTH = 3
+# Print sheets, sizes in inches
+SHEET_SIZES = {"letter": (8.5, 11), "a4": (8.27, 11.69)}
+SHEET_SIZE = "letter"
+SHEET_GRID = (2, 3)
+SHEET_DPI = 300
+SHEET_MARGIN = 0.4
+SHEET_JPEG_QUALITY = 90
+VECTOR_PDF_FILE = "seatingCards.pdf"
+
+# Template used by worker processes, set up by init_worker
+_worker_template = None
 
 
 def open_guestlist(guest_file):
@@ -46,66 +68,519 @@ def open_guestlist(guest_file):
         print("Guestlist file not found or corrupted, please try again.")
 
 
-def process_guestlist(guest_file):
+def load_template():
+    """
+    Decodes the template image once so cards can be made by copying its
+    pixels instead of decoding the JPEG for every guest. Returns the decoded
+    template Image object.
+    """
+
+    try:
+        with Image.open(TEMPLATE) as template:
+            template.load()
+            return template.copy()
+    except IOError:
+        print("Template image file not found or corrupted, please try again.")
+        quit()
+
+
+def process_guestlist(
+        guest_file,
+        workers=1,
+        chunksize=CARD_CHUNKSIZE,
+        sheets_file=None,
+        vector_format=None):
     """
     Processes a list of names to make individual seating cards. Takes in a
-    list of strings representing guest names.
+    list of strings representing guest names, and optionally the number of
+    worker processes (workers), the number of guests handed to a worker at a
+    time (chunksize), a PDF or TIFF filename (sheets_file) and a vector
+    format, "pdf" or "svg" (vector_format). Cards are made in the current
+    process if workers is 1. If sheets_file is given, cards are laid out on
+    print sheets saved to that single file instead of one PNG file per
+    guest. If vector_format is given, vector cards are made instead.
     """
 
     guests = open_guestlist(os.path.basename(guest_file))
 
-    for guest in guests:
+    # Removing new line from guest strings
+    guests = [guest.strip() for guest in guests]
 
-        # Removing new line from guest string
-        guest = guest.strip()
+    template = load_template()
+    start_time = time.perf_counter()
 
-        make_card(guest)
+    if vector_format:
+        make_vector_cards(guests, template, vector_format)
+    elif sheets_file:
+        sheets = save_sheets(iter_sheets(guests, template), sheets_file)
+        print(f"Saved {sheets} print sheets to {sheets_file}.")
+    elif workers == 1:
+        for guest in guests:
+            make_card(guest, template)
+    else:
+        # Template is decoded once and handed to each worker as raw pixels
+        with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=init_worker,
+                initargs=(template.mode, template.size, template.tobytes())
+                ) as executor:
+            for _ in executor.map(
+                    make_card_worker, guests, chunksize=chunksize):
+                pass
 
+    elapsed = time.perf_counter() - start_time
+    print(
+        f"Created {len(guests)} seating cards in {elapsed:.2f}s "
+        f"({len(guests) / elapsed if elapsed else 0:.1f} cards/sec).")
 
-def make_card(guest):
+
+@functools.lru_cache(maxsize=TEXT_CACHE_SIZE)
+def measure_text(text, font):
+    """
+    Measures the size a text takes when drawn with a font, caching the
+    result for repeated names. Takes in a string (text) and an ImageFont
+    object (font), and returns a (width, height) tuple.
+    """
+
+    if hasattr(font, "getbbox"):
+        # Pillow 8+, same measurement as the removed ImageDraw.textsize
+        _, _, text_width, text_height = font.getbbox(text)
+        return text_width, text_height
+
+    return font.getsize(text)
+
+
+def make_card(guest, template=None):
     """
     Creates image files for individual seating cards. Takes in a string
-    representing a guest name.
+    representing a guest name and optionally the decoded template Image
+    object, which is copied for the card instead of opening TEMPLATE.
     """
 
     # Set up card variables
-    try:
-        card = Image.open(TEMPLATE).copy()
-    except IOError:
-        print("Template image file not found or corrupted, please try again.")
-        quit()
+    if template is not None:
+        card = template.copy()
+    else:
+        card = load_template()
 
     print(f"Creating seating card for {guest}...")
 
-    card_width, card_height = card.size
-    custom_guest = ImageDraw.Draw(card)
-    custom_width, custom_height = custom_guest.textsize(guest, font=TXT_FONT)
+    draw_card(card, guest, TXT_FONT, BORDER_WIDTH)
+
+    # Create filename and save card image file
+    filename = guest.lower().replace(" ", "").replace(".", "") + ".png"
+    card.save(filename)
+
+
+def card_layout(guest, card_size, text_size, border_width):
+    """
+    Lays out a seating card, with the guest name centered and a border along
+    the edges for cutting. Takes in a string representing a guest name, a
+    (width, height) tuple for the card (card_size), a (width, height) tuple
+    for the guest name text (text_size) and an int for the border width, and
+    returns the (x, y) text position and the list of border points.
+    """
+
+    card_width, card_height = card_size
+    custom_width, custom_height = text_size
 
     # Width and height for centering text
     center_width = (card_width - custom_width) / 2
     center_height = (card_height - custom_height) / 2
 
+    # Border points
+    points = [
+        (0, 0),
+        (card_width - border_width, 0),
+        (card_width - border_width, card_height - border_width),
+        (0, card_height - border_width), (0, 0)
+        ]
+
+    return (center_width, center_height), points
+
+
+def draw_card(card, guest, font, border_width):
+    """
+    Draws the guest name and border onto a seating card. Takes in the card
+    Image object, which is modified in place, a string representing a guest
+    name, an ImageFont object (font) and an int for the border width.
+    """
+
+    custom_guest = ImageDraw.Draw(card)
+    position, points = card_layout(
+        guest, card.size, measure_text(guest, font), border_width)
+
     # Drawing text
     custom_guest.text(
-        (center_width, center_height),
+        position,
         guest,
         fill=COLOR,
-        font=TXT_FONT
+        font=font
         )
 
     # Drawing borders
-    points = [
-        (0, 0),
-        (card_width - 3, 0),
-        (card_width - 3, card_height - 3),
-        (0, card_height - 3), (0, 0)
-        ]
+    custom_guest.line(points, fill=COLOR, width=border_width)
 
-    custom_guest.line(points, fill=COLOR, width=3)
 
-    # Create filename and save card image file
-    filename = guest.lower().replace(" ", "").replace(".", "") + ".png"
-    card.save(filename)
+def make_vector_cards(guests, template, vector_format):
+    """
+    Creates vector seating cards, with the template image placed once and
+    shared by every card and the guest names laid out as text, using the
+    same layout as make_card. PDF cards are the pages of a single
+    VECTOR_PDF_FILE file that embeds the template and font once. SVG cards
+    are one file per guest, named like the PNG cards, that link to the
+    TEMPLATE file. Takes in a list of strings representing guest names, the
+    decoded template Image object and a string for the format ("pdf" or
+    "svg").
+    """
+
+    card_width, card_height = template.size
+    ascent, _ = TXT_FONT.getmetrics()
+
+    if vector_format == "pdf":
+        pdf = pdf_open(VECTOR_PDF_FILE)
+        image = pdf_template(pdf, template)
+        font = pdf_font(pdf, TXT_FONT)
+        resources = (
+            f"/XObject << /Template {image} 0 R >> "
+            f"/Font << /Name {font} 0 R >>")
+
+    for guest in guests:
+        print(f"Creating seating card for {guest}...")
+        (text_x, text_y), points = card_layout(
+            guest, template.size, measure_text(guest, TXT_FONT),
+            BORDER_WIDTH)
+
+        # Text is placed by its baseline, below the ascender line
+        baseline = text_y + ascent
+
+        if vector_format == "pdf":
+            # PDF y axis points up
+            name = guest.encode("cp1252", "replace")
+            for char in b"\\()":
+                name = name.replace(bytes([char]), b"\\" + bytes([char]))
+            path = " ".join(
+                f"{x + BORDER_WIDTH / 2:.1f} "
+                f"{card_height - y - BORDER_WIDTH / 2:.1f} "
+                f"{'m' if index == 0 else 'l'}"
+                for index, (x, y) in enumerate(points))
+            contents = (
+                f"q {card_width} 0 0 {card_height} 0 0 cm /Template Do Q\n"
+                f"BT /Name {TXT_FONT.size} Tf "
+                f"{text_x:.2f} {card_height - baseline:.2f} Td (").encode() \
+                + name + (
+                    f") Tj ET\n{BORDER_WIDTH} w {path} S\n").encode()
+            pdf_page(pdf, template.size, contents, resources)
+
+        else:
+            path = " ".join(
+                f"{'M' if index == 0 else 'L'}{x + BORDER_WIDTH / 2:.1f},"
+                f"{y + BORDER_WIDTH / 2:.1f}"
+                for index, (x, y) in enumerate(points))
+            family, _ = TXT_FONT.getname()
+            filename = guest.lower().replace(" ", "").replace(".", "") + \
+                ".svg"
+
+            with open(filename, "w", encoding="utf-8") as svg_file:
+                svg_file.write(
+                    '<svg xmlns="http://www.w3.org/2000/svg" '
+                    'xmlns:xlink="http://www.w3.org/1999/xlink" '
+                    f'width="{card_width}" height="{card_height}" '
+                    f'viewBox="0 0 {card_width} {card_height}">\n'
+                    f'<image xlink:href="{escape(TEMPLATE)}" '
+                    f'width="{card_width}" height="{card_height}"/>\n'
+                    f'<text x="{text_x:.2f}" y="{baseline:.2f}" '
+                    f'font-family="{escape(family)}" '
+                    f'font-size="{TXT_FONT.size}" fill="{COLOR}">'
+                    f'{escape(guest)}</text>\n'
+                    f'<path d="{path}" fill="none" stroke="{COLOR}" '
+                    f'stroke-width="{BORDER_WIDTH}"/>\n'
+                    '</svg>\n')
+
+    if vector_format == "pdf":
+        pdf_close(pdf)
+
+
+def pdf_template(pdf, template):
+    """
+    Adds the template image to a PDF file as an image object that pages can
+    share. The TEMPLATE JPEG file is embedded as is when possible, and the
+    decoded template is encoded to JPEG otherwise. Takes in the PDF writing
+    state dict and the decoded template Image object, and returns the image
+    object number.
+    """
+
+    with Image.open(TEMPLATE) as template_file:
+        embed_as_is = template_file.format == "JPEG" and \
+            template_file.mode in ("L", "RGB")
+
+    if embed_as_is:
+        with open(TEMPLATE, "rb") as template_file:
+            jpeg = template_file.read()
+    else:
+        buffer = io.BytesIO()
+        template.convert("RGB").save(buffer, "JPEG", quality=95)
+        jpeg = buffer.getvalue()
+
+    color_space = "DeviceGray" if template.mode == "L" else "DeviceRGB"
+
+    return pdf_object(pdf, (
+        f"<< /Type /XObject /Subtype /Image /Width {template.width} "
+        f"/Height {template.height} /ColorSpace /{color_space} "
+        "/BitsPerComponent 8 /Filter /DCTDecode"), jpeg)
+
+
+def pdf_font(pdf, font):
+    """
+    Embeds a TrueType font in a PDF file, with character widths taken from
+    the same font Pillow measures the guest names with, so the text is
+    centered exactly as in the image cards. Takes in the PDF writing state
+    dict and a FreeTypeFont object, and returns the font object number.
+    """
+
+    with open(font.path, "rb") as font_file:
+        font_data = font_file.read()
+
+    # Glyph metrics in thousandths of the font size
+    units = 1000 / font.size
+    widths = []
+    for code in range(32, 256):
+        try:
+            char = bytes([code]).decode("cp1252")
+        except UnicodeDecodeError:
+            widths.append(0)
+            continue
+        widths.append(round(font.getlength(char) * units))
+
+    ascent, descent = font.getmetrics()
+    base_font = "".join(font.getname()[0].split())
+    font_file = pdf_object(
+        pdf, f"<< /Length1 {len(font_data)}", font_data)
+    descriptor = pdf_object(pdf, (
+        f"<< /Type /FontDescriptor /FontName /{base_font} /Flags 32 "
+        f"/FontBBox [0 {-round(descent * units)} 1000 "
+        f"{round(ascent * units)}] /ItalicAngle 0 "
+        f"/Ascent {round(ascent * units)} /Descent {-round(descent * units)} "
+        f"/CapHeight {round(ascent * units)} /StemV 80 "
+        f"/FontFile2 {font_file} 0 R >>"))
+
+    return pdf_object(pdf, (
+        f"<< /Type /Font /Subtype /TrueType /BaseFont /{base_font} "
+        f"/FirstChar 32 /LastChar 255 /Widths [{' '.join(map(str, widths))}] "
+        f"/Encoding /WinAnsiEncoding /FontDescriptor {descriptor} 0 R >>"))
+
+
+def iter_sheets(
+        guests,
+        template,
+        sheet_size=SHEET_SIZE,
+        grid=SHEET_GRID,
+        dpi=SHEET_DPI):
+    """
+    Renders seating cards straight onto print sheets, a grid of cards per
+    sheet with crop marks in the margins at every cut line. The template and
+    font are scaled once to the card size on the sheet, and only one sheet
+    is kept in memory at a time. Takes in a list of strings representing
+    guest names, the decoded template Image object, the sheet size name
+    (a key of SHEET_SIZES), a (columns, rows) tuple (grid) and the print
+    resolution in dots per inch (dpi). Yields one Image object per sheet.
+    """
+
+    sheet_width, sheet_height = (
+        round(inches * dpi) for inches in SHEET_SIZES[sheet_size])
+    margin = round(SHEET_MARGIN * dpi)
+    columns, rows = grid
+
+    # Largest card size that fits the grid and keeps the template's shape
+    scale = min(
+        (sheet_width - 2 * margin) / columns / template.width,
+        (sheet_height - 2 * margin) / rows / template.height)
+    card_width = int(template.width * scale)
+    card_height = int(template.height * scale)
+    card_template = template.resize((card_width, card_height))
+    card_font = ImageFont.truetype(TXT_FONT.path, round(TXT_FONT.size * scale))
+    border_width = max(1, round(BORDER_WIDTH * scale))
+
+    # Grid is centered on the sheet
+    left = (sheet_width - columns * card_width) // 2
+    top = (sheet_height - rows * card_height) // 2
+    cut_xs = [left + column * card_width for column in range(columns + 1)]
+    cut_ys = [top + row * card_height for row in range(rows + 1)]
+
+    cards_per_sheet = columns * rows
+
+    for first in range(0, len(guests), cards_per_sheet):
+        sheet = Image.new(template.mode, (sheet_width, sheet_height), "white")
+        guides = ImageDraw.Draw(sheet)
+
+        for index, guest in enumerate(
+                guests[first:first + cards_per_sheet]):
+            print(f"Creating seating card for {guest}...")
+            card = card_template.copy()
+            draw_card(card, guest, card_font, border_width)
+            row, column = divmod(index, columns)
+            sheet.paste(card, (cut_xs[column], cut_ys[row]))
+
+        # Crop marks, kept out of the cards
+        mark = max(1, round(dpi / 300))
+        for x in cut_xs:
+            guides.line([(x, 0), (x, top - margin // 2)], COLOR, mark)
+            guides.line(
+                [(x, cut_ys[-1] + margin // 2), (x, sheet_height)],
+                COLOR, mark)
+        for y in cut_ys:
+            guides.line([(0, y), (left - margin // 2, y)], COLOR, mark)
+            guides.line(
+                [(cut_xs[-1] + margin // 2, y), (sheet_width, y)],
+                COLOR, mark)
+
+        yield sheet
+
+
+def save_sheets(sheets, filename, dpi=SHEET_DPI):
+    """
+    Saves print sheets as the pages of a single PDF or multi-page TIFF file,
+    writing each sheet as soon as it's rendered. Takes in an iterable of
+    sheet Image objects, a string for the output filename (.pdf, .tif or
+    .tiff) and the print resolution in dots per inch (dpi), and returns the
+    number of sheets saved.
+    """
+
+    saved = 0
+
+    if filename.lower().endswith(".pdf"):
+        pdf = pdf_open(filename)
+
+        for sheet in sheets:
+            jpeg = io.BytesIO()
+            sheet.save(jpeg, "JPEG", quality=SHEET_JPEG_QUALITY)
+            color_space = "DeviceGray" if sheet.mode == "L" else "DeviceRGB"
+            image = pdf_object(pdf, (
+                f"<< /Type /XObject /Subtype /Image /Width {sheet.width} "
+                f"/Height {sheet.height} /ColorSpace /{color_space} "
+                "/BitsPerComponent 8 /Filter /DCTDecode"), jpeg.getvalue())
+
+            # Page size in points, 72 per inch
+            page_width = sheet.width * 72 / dpi
+            page_height = sheet.height * 72 / dpi
+            pdf_page(
+                pdf, (page_width, page_height),
+                f"q {page_width:.2f} 0 0 {page_height:.2f} 0 0 cm /Sheet Do "
+                "Q".encode(), f"/XObject << /Sheet {image} 0 R >>")
+            saved += 1
+
+        pdf_close(pdf)
+
+    else:
+        with TiffImagePlugin.AppendingTiffWriter(filename, new=True) as tiff:
+            for sheet in sheets:
+                sheet.save(
+                    tiff, "TIFF", compression="tiff_deflate", dpi=(dpi, dpi))
+                tiff.newFrame()
+                saved += 1
+
+    return saved
+
+
+def pdf_open(filename):
+    """
+    Starts writing a PDF file whose objects are written out as they are
+    added. Object 1 is kept for the page tree and object 2 for the catalog,
+    which are only written by pdf_close. Takes in a string for the PDF
+    filename and returns a dict holding the PDF writing state.
+    """
+
+    pdf_file = open(filename, "wb")
+    # Binary comment marks the file as binary for transfer tools
+    pdf_file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    return {"file": pdf_file, "offsets": {}, "next": 3, "pages": []}
+
+
+def pdf_object(pdf, dictionary, stream=None, number=None):
+    """
+    Writes an object to a PDF file. Takes in the PDF writing state dict, a
+    string holding the object's dictionary (without the closing ">>" if a
+    stream follows), optionally the stream bytes, and optionally the object
+    number, and returns the object number.
+    """
+
+    if number is None:
+        number = pdf["next"]
+        pdf["next"] += 1
+
+    pdf_file = pdf["file"]
+    pdf["offsets"][number] = pdf_file.tell()
+    pdf_file.write(f"{number} 0 obj\n{dictionary}".encode("latin-1"))
+
+    if stream is not None:
+        pdf_file.write(f" /Length {len(stream)} >>\nstream\n".encode())
+        pdf_file.write(stream)
+        pdf_file.write(b"\nendstream")
+
+    pdf_file.write(b"\nendobj\n")
+
+    return number
+
+
+def pdf_page(pdf, page_size, contents, resources):
+    """
+    Adds a page to a PDF file. Takes in the PDF writing state dict, a
+    (width, height) tuple in points (page_size), the page content stream
+    bytes and a string with the entries of the page resources dictionary.
+    """
+
+    page_width, page_height = page_size
+    contents = pdf_object(pdf, "<<", contents)
+    page = pdf_object(pdf, (
+        f"<< /Type /Page /Parent 1 0 R "
+        f"/MediaBox [0 0 {page_width:.2f} {page_height:.2f}] "
+        f"/Resources << {resources} >> /Contents {contents} 0 R >>"))
+    pdf["pages"].append(page)
+
+
+def pdf_close(pdf):
+    """
+    Finishes a PDF file by writing the page tree, catalog and cross-reference
+    table, and closes it. Takes in the PDF writing state dict.
+    """
+
+    kids = " ".join(f"{page} 0 R" for page in pdf["pages"])
+    pdf_object(pdf, (
+        f"<< /Type /Pages /Kids [{kids}] /Count {len(pdf['pages'])} >>"),
+        number=1)
+    pdf_object(pdf, "<< /Type /Catalog /Pages 1 0 R >>", number=2)
+
+    pdf_file = pdf["file"]
+    xref = pdf_file.tell()
+    pdf_file.write(f"xref\n0 {pdf['next']}\n".encode())
+    pdf_file.write(b"0000000000 65535 f \n")
+    for number in range(1, pdf["next"]):
+        pdf_file.write(f"{pdf['offsets'][number]:010d} 00000 n \n".encode())
+    pdf_file.write((
+        f"trailer\n<< /Size {pdf['next']} /Root 2 0 R >>\n"
+        f"startxref\n{xref}\n%%EOF\n").encode())
+    pdf_file.close()
+
+
+def init_worker(template_mode, template_size, template_data):
+    """
+    Rebuilds the decoded template Image object in a worker process. Takes
+    in the template mode, size and raw pixel data.
+    """
+
+    global _worker_template
+    _worker_template = Image.frombytes(
+        template_mode, template_size, template_data)
+
+
+def make_card_worker(guest):
+    """
+    Creates a seating card in a worker process from the worker's template.
+    Takes in a string representing a guest name.
+    """
+
+    make_card(guest, _worker_template)
 
 
 def main():
@@ -123,7 +598,24 @@ def main():
         else:
             print("Invalid file, please try again.")
 
-    process_guestlist(guest_file)
+    vector_format = input(
+        "Please enter 'pdf' or 'svg' to make vector cards, or press ENTER to "
+        "make image cards:\n").lower()
+    if vector_format not in ("pdf", "svg"):
+        vector_format = None
+
+        sheets_file = input(
+            "Please enter a .pdf or .tif filename to lay the cards out on "
+            "print sheets, or press ENTER to save one image file per "
+            "guest:\n")
+        if not sheets_file.lower().endswith((".pdf", ".tif", ".tiff")):
+            sheets_file = None
+    else:
+        sheets_file = None
+
+    process_guestlist(
+        guest_file, workers=CARD_WORKERS, sheets_file=sheets_file,
+        vector_format=vector_format)
 
     print("Done.")
 
@@ -20,47 +20,608 @@
 # 
 # Nadia Borsch      misc@nborsch.com        Jun/2018
 
-import os, openpyxl, csv
-
-print(f"\n{'Spreadsheet To CSV':>35}")
-print(f"{'=========== == ===':>35}")
-
-# Get folder path from user
-print(f"\nCurrent working directory is {os.getcwd()}:")
-path = input("Please enter the desired folder path or leave blank to stay in current working directory.\n")
-if path:
-    os.chdir(path)
-else:
-    path = "."
-
-# Loop through all workbook files
-for workbook in os.listdir(path):
-    # Skip files that are not spreadsheet files
-    if not workbook.endswith(".xlsx"):
-        continue
-    
+import csv
+import datetime
+import functools
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import openpyxl
+import pyarrow as pa
+import pyarrow.csv
+import pyarrow.parquet as pq
+from openpyxl.utils import get_column_letter
+
+from spreadsheetIO import file_hash
+from spreadsheetIO import iter_worksheets
+from spreadsheetIO import iter_worksheets_fast
+from spreadsheetIO import map_worksheets
+from spreadsheetIO import peak_memory
+from spreadsheetIO import read_worksheet
+from spreadsheetIO import worksheet_names
+
+# Constants
+CONVERT_WORKERS = os.cpu_count() or 1
+OUTPUT_FORMATS = ("csv", "parquet")
+# Each output format keeps its own state, so converting to one format
+# leaves the files of the other alone
+STATE_FILES = {
+    "csv": "excel2csv_state.json",
+    "parquet": "excel2csv_parquet_state.json",
+    }
+# Rows held in memory and written to a Parquet file at a time
+PARQUET_BATCH_ROWS = 65536
+PARQUET_COMPRESSION = "zstd"
+# Arrow types for the column kinds inferred from cell values
+KIND_TYPES = {
+    None: pa.string(),
+    "bool": pa.bool_(),
+    "int": pa.int64(),
+    "float": pa.float64(),
+    "datetime": pa.timestamp("us"),
+    "date": pa.date32(),
+    "time": pa.time64("us"),
+    "timedelta": pa.duration("us"),
+    "string": pa.string(),
+    }
+BENCHMARK_ROWS = 200000
+BENCHMARK_FILE = "benchmark.xlsx"
+
+
+def output_filename(workbook, worksheet_name, output_format="csv"):
+    """
+    Names the output file for a worksheet as <workbook>_<sheet>.<format>.
+    Takes in the workbook filename, the worksheet name and the output
+    format, and returns the output filename.
+    """
+
+    return f"{os.path.splitext(workbook)[0]}_{worksheet_name}.{output_format}"
+
+
+def value_kinds(column):
+    """
+    Finds the kind of values in a column of cells, widening mixed kinds as
+    little as possible: integers and floats make a float column, and any
+    other mix makes a string column. Takes in a sequence of cell values and
+    returns the column kind, or None if every cell is empty.
+    """
+
+    kind = None
+
+    for value_type in set(map(type, column)):
+        if value_type is type(None):
+            continue
+        elif value_type is bool:
+            value_kind = "bool"
+        elif value_type is int:
+            # Integers that don't fit 64 bits are kept as text
+            value_kind = "int" if all(
+                -2 ** 63 <= value < 2 ** 63 for value in column
+                if type(value) is int) else "string"
+        elif value_type is float:
+            value_kind = "float"
+        elif value_type is datetime.datetime:
+            value_kind = "datetime"
+        elif value_type is datetime.date:
+            value_kind = "date"
+        elif value_type is datetime.time:
+            value_kind = "time"
+        elif value_type is datetime.timedelta:
+            value_kind = "timedelta"
+        else:
+            value_kind = "string"
+
+        kind = merge_kinds(kind, value_kind)
+
+    return kind
+
+
+def merge_kinds(kind, other):
+    """
+    Widens a column kind so it also holds values of another kind. Takes in
+    both kinds and returns the merged kind.
+    """
+
+    if kind is None or kind == other:
+        return other
+    if other is None:
+        return kind
+    if {kind, other} == {"int", "float"}:
+        return "float"
+    return "string"
+
+
+def infer_kinds(batch, kinds=()):
+    """
+    Widens the column kinds of a sheet to fit a batch of rows. Takes in a
+    list of row tuples and the column kinds found so far, and returns the
+    list of column kinds.
+    """
+
+    width = max([len(kinds)] + [len(row) for row in batch])
+    kinds = list(kinds) + [None] * (width - len(kinds))
+
+    for index, column in enumerate(zip(*pad_rows(batch, width))):
+        kinds[index] = merge_kinds(kinds[index], value_kinds(column))
+
+    return kinds
+
+
+def pad_rows(batch, width):
+    """
+    Pads every row of a batch with None up to the same width. Takes in a
+    list of row tuples and the width, and returns the list of padded rows.
+    """
+
+    return [row + (None,) * (width - len(row)) for row in batch]
+
+
+def column_names(batch, header=False):
+    """
+    Names the columns of a sheet from its first row if it's a header row,
+    and by column letter otherwise. Blank or repeated names are replaced by
+    the column letter. Takes in the first batch of rows and whether the
+    first row is a header row (header), and returns the list of column
+    names and the batch without the header row.
+    """
+
+    if not header or not batch:
+        return [], batch
+
+    names = []
+    for index, value in enumerate(batch[0], 1):
+        letter = get_column_letter(index)
+        if value is None or not str(value).strip():
+            name = letter
+        else:
+            name = str(value)
+        names.append(f"{name}_{letter}" if name in names else name)
+
+    return names, batch[1:]
+
+
+def record_batch(batch, schema, kinds):
+    """
+    Converts a batch of rows to an Arrow record batch, one typed array per
+    column. Values in text columns are written the way the CSV writer
+    would. Takes in a list of row tuples, the Arrow schema and the column
+    kinds, and returns the RecordBatch.
+    """
+
+    columns = zip(*pad_rows(batch, len(kinds))) if batch else [
+        ()] * len(kinds)
+    arrays = []
+
+    for column, kind in zip(columns, kinds):
+        if kind in (None, "string"):
+            column = [
+                None if value is None else str(value) for value in column]
+        arrays.append(pa.array(column, type=KIND_TYPES[kind]))
+
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def write_parquet(filename, rows, reread, header=False):
+    """
+    Writes the rows of a worksheet to a compressed Parquet file, one batch
+    of PARQUET_BATCH_ROWS rows at a time. Column types are inferred from the
+    first batch; if a later batch doesn't fit them, the rest of the sheet is
+    scanned for the types that fit every row and the file is written again
+    from a fresh read of the sheet. Columns are named by letter unless the
+    first row is taken as a header row. Takes in the Parquet filename, an
+    iterator of row tuples, a function that returns a new iterator over the
+    same rows and whether the first row names the columns (header), and
+    returns the number of rows read.
+    """
+
+    kinds = []
+
+    while True:
+        rows = iter(rows)
+        batches = iter(lambda: list(itertools.islice(
+            rows, PARQUET_BATCH_ROWS)), [])
+        first = next(batches, [])
+        names, data = column_names(first, header)
+        # Header row
+        count = len(first) - len(data)
+        kinds = infer_kinds(data, kinds)
+        names += [
+            get_column_letter(index)
+            for index in range(len(names) + 1, len(kinds) + 1)
+            ]
+        schema = pa.schema([
+            (name, KIND_TYPES[kind]) for name, kind in zip(names, kinds)
+            ])
+
+        with pq.ParquetWriter(
+                filename, schema, compression=PARQUET_COMPRESSION) as writer:
+            for batch in itertools.chain([data], batches):
+                widened = infer_kinds(batch, kinds)
+                if widened != kinds:
+                    break
+
+                writer.write_batch(record_batch(batch, schema, kinds))
+                count += len(batch)
+
+            else:
+                return count
+
+        # A later batch doesn't fit the types inferred so far
+        kinds = widened
+        for batch in batches:
+            kinds = infer_kinds(batch, kinds)
+        rows = reread()
+
+
+def convert_worksheet(
+        workbook, worksheet_name, fast=False, output_format="csv",
+        header=False, worksheet_rows=None):
+    """
+    Converts a worksheet to a CSV or Parquet file, streaming its rows
+    straight into the output file. Takes in the workbook filename, the
+    worksheet name, whether to use the native xlsx reader (fast), the output
+    format, whether the first row names the Parquet columns (header) and
+    the worksheet's rows if already being read (read from the workbook if
+    None), and returns a tuple with the number of rows written and the
+    output filename.
+    """
+
+    print(f"Working through sheet {worksheet_name}...")
+    output = output_filename(workbook, worksheet_name, output_format)
+    rows = 0
+
+    if worksheet_rows is None:
+        worksheet_rows = read_worksheet(workbook, worksheet_name, fast)
+
+    if output_format == "parquet":
+        rows = write_parquet(output, worksheet_rows, functools.partial(
+            read_worksheet, workbook, worksheet_name, fast), header)
+
+    else:
+        with open(output, "w", newline="", encoding="UTF-16") as csv_file:
+            csv_writer = csv.writer(csv_file)
+
+            # Write every row in current worksheet as it is read
+            for row_data in worksheet_rows:
+                csv_writer.writerow(row_data)
+                rows += 1
+
+    print(f"Saved {output}.\n")
+
+    return rows, output
+
+
+def convert_workbook(
+        workbook, fast=False, output_format="csv", workers=1, header=False):
+    """
+    Converts every worksheet of a workbook to a CSV or Parquet file. Rows
+    are streamed straight into the output file, so the workbook is never
+    fully loaded. With more than one worker, several worksheets are
+    converted at a time in worker processes. Takes in the workbook filename,
+    whether to read it with the native xlsx reader instead of openpyxl
+    (fast), the output format, the number of worker processes and whether
+    the first row of each sheet names the Parquet columns (header), and
+    returns a tuple with the filename, the number of rows written, the time
+    taken in seconds, the peak memory of the process in MiB and the list of
+    files written.
+    """
+
     print(f"Opening {workbook}...")
-    wb = openpyxl.load_workbook(workbook)
-
-    # Loop through all worksheets in current workbook
-    for worksheet_name in wb.sheetnames:
-        worksheet = wb[worksheet_name]
-        csv_file = open(f"{workbook.rstrip('.xlsx')}_{worksheet_name}.csv", "w", newline="", encoding="UTF-16")
-        csv_writer = csv.writer(csv_file)
-        print(f"Working through sheet {worksheet_name}...")
-        
-        # Loop through every row in current worksheet
-        for row in range(1, worksheet.max_row + 1):
-            row_data = []
-            
-            # Loop through every cell in current row
-            for column in range(1, worksheet.max_column + 1):
-                row_data.append(worksheet.cell(row=row, column=column).value)
-                
-            # Write current row in csv file
-            csv_writer.writerow(row_data)
-        
-        csv_file.close()
-        print(f"Saved {workbook.rstrip('.xlsx')}_{worksheet_name}.csv.\n")
-
-print("Done.")
+    start_time = time.perf_counter()
+
+    if workers > 1:
+        sheet_names, _ = worksheet_names(workbook)
+        results = list(map_worksheets(
+            convert_worksheet, workbook, sheet_names, fast, output_format,
+            header, workers=min(workers, len(sheet_names) or 1)))
+
+    else:
+        worksheets = iter_worksheets_fast if fast else iter_worksheets
+
+        # Loop through all worksheets in current workbook
+        results = [
+            convert_worksheet(
+                workbook, worksheet_name, fast, output_format, header,
+                worksheet_rows)
+            for worksheet_name, worksheet_rows in worksheets(workbook)
+            ]
+
+    return (
+        workbook, sum(rows for rows, _ in results),
+        time.perf_counter() - start_time, peak_memory(),
+        [output for _, output in results])
+
+
+def check_fast_path(workbook):
+    """
+    Checks that the native xlsx reader returns the same worksheets and cell
+    values as openpyxl's read-only mode, and prints the first difference
+    found. Takes in the workbook filename and returns True if both match.
+    """
+
+    for (name, rows), (fast_name, fast_rows) in itertools.zip_longest(
+            iter_worksheets(workbook), iter_worksheets_fast(workbook),
+            fillvalue=(None, ())):
+        if name != fast_name:
+            print(f"{workbook}: worksheet {name!r} read as {fast_name!r}")
+            return False
+
+        for number, (row, fast_row) in enumerate(itertools.zip_longest(
+                rows, fast_rows), 1):
+            if row != fast_row:
+                print(
+                    f"{workbook}: worksheet {name!r} row {number} differs:"
+                    f"\n  openpyxl: {row!r}\n  fast:     {fast_row!r}")
+                return False
+
+    return True
+
+
+def save_state(path, state, output_format="csv"):
+    """
+    Writes the conversion state file, replacing the previous one only once
+    the new one is complete. Takes in the folder path, the state dict and
+    the output format it belongs to.
+    """
+
+    state_file = os.path.join(path, STATE_FILES[output_format])
+
+    with open(state_file + ".tmp", "w") as new_state:
+        json.dump(state, new_state, indent=1)
+
+    os.replace(state_file + ".tmp", state_file)
+
+
+def outdated_workbooks(
+        path, workbooks, incremental=True, output_format="csv",
+        header=False):
+    """
+    Checks which workbooks need converting again according to the state file
+    kept in the folder for the output format. A workbook is up to date if
+    its size and mtime (or, failing that, its content hash) match the state
+    file and all the files it produced still exist. Every workbook is
+    outdated if the output settings changed since the state file was
+    written. Takes in the folder
+    path, the list of workbook filenames in it, whether to check the state
+    file at all (incremental), the output format and whether first rows
+    name the Parquet columns (header). Returns the list of workbooks
+    to convert, the state dict to update, a dict of source records for the
+    workbooks to convert and a dict of the files previously produced by
+    each workbook.
+    """
+
+    settings = {"output_format": output_format, "header": header}
+    state = {"settings": settings, "workbooks": {}}
+
+    try:
+        with open(os.path.join(path, STATE_FILES[output_format])) as old_state:
+            previous = json.load(old_state)
+    except (OSError, ValueError):
+        previous = {}
+
+    old_settings = dict(
+        {"output_format": "csv", "header": False},
+        **previous.get("settings", {}))
+    if old_settings["output_format"] == output_format:
+        old_workbooks = previous.get("workbooks", {})
+    else:
+        # Written for another format, whose files are left alone
+        old_workbooks = {}
+
+    if old_settings == settings:
+        previous = old_workbooks
+    else:
+        # Output settings changed, convert everything
+        previous = {}
+
+    outdated = []
+    pending = {}
+
+    for workbook in workbooks:
+        stat = os.stat(os.path.join(path, workbook))
+        source = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+        old = previous.get(workbook)
+
+        if old and (old["size"], old["mtime"]) == (
+                source["size"], source["mtime"]):
+            source["hash"] = old["hash"]
+        else:
+            source["hash"] = file_hash(os.path.join(path, workbook))
+
+        if incremental and old and old["hash"] == source["hash"] and all(
+                os.path.exists(os.path.join(path, output))
+                for output in old["outputs"]):
+            # Output files are up to date
+            state["workbooks"][workbook] = dict(
+                source, outputs=old["outputs"])
+            continue
+
+        outdated.append(workbook)
+        pending[workbook] = source
+
+    old_outputs = {
+        workbook: old["outputs"] for workbook, old in old_workbooks.items()
+        if workbook not in state["workbooks"]
+        }
+
+    return outdated, state, pending, old_outputs
+
+
+def remove_outputs(path, outputs):
+    """
+    Deletes output files left over from worksheets or workbooks that no
+    longer exist. Takes in the folder path and the list of output
+    filenames.
+    """
+
+    for output in outputs:
+        try:
+            os.remove(os.path.join(path, output))
+            print(f"Removed {output}.")
+        except FileNotFoundError:
+            pass
+
+
+def convert_folder(
+        path,
+        workers=CONVERT_WORKERS,
+        fast=False,
+        incremental=True,
+        output_format="csv",
+        header=False):
+    """
+    Converts every workbook in a folder to CSV or Parquet files, several
+    workbooks at a time in worker processes, and prints rows/sec and peak
+    memory for each. Each workbook is converted in a fresh process so its
+    peak memory isn't mixed up with other workbooks', and a lone workbook
+    has its worksheets converted in parallel instead. Workbooks that haven't
+    changed since the last run are skipped, workbooks that can't be read are
+    reported and tried again on the next run, and output files for
+    worksheets or workbooks that no longer exist are removed. Takes in the
+    folder path, the number of worker processes, whether to use the native
+    xlsx reader (fast), whether to skip unchanged workbooks (incremental),
+    the output format and whether the first row of each sheet names the
+    Parquet columns (header).
+    """
+
+    # Skip files that are not spreadsheet files, and Excel's lock files for
+    # workbooks that are open
+    workbooks = [
+        workbook for workbook in os.listdir(path)
+        if workbook.endswith(".xlsx") and not workbook.startswith("~$")
+        ]
+
+    outdated, state, pending, old_outputs = outdated_workbooks(
+        path, workbooks, incremental, output_format, header)
+    print(
+        f"{len(outdated)} of {len(workbooks)} workbooks need converting.")
+
+    results = []
+    failed = []
+
+    def add_result(workbook, convert):
+        # A workbook that can't be converted is left out of the state, so
+        # that it's tried again next time
+        try:
+            results.append(convert())
+        except Exception as error:
+            failed.append(workbook)
+            print(f"Could not convert {workbook}: {error}")
+
+    if len(outdated) == 1:
+        # A single workbook is split up by worksheet instead
+        add_result(outdated[0], functools.partial(
+            convert_workbook, os.path.join(path, outdated[0]), fast,
+            output_format, workers, header))
+    elif outdated:
+        with ProcessPoolExecutor(
+                max_workers=workers, max_tasks_per_child=1) as executor:
+            futures = [
+                executor.submit(
+                    convert_workbook, os.path.join(path, workbook), fast,
+                    output_format, 1, header)
+                for workbook in outdated
+                ]
+
+            for workbook, future in zip(outdated, futures):
+                add_result(workbook, future.result)
+
+    for workbook, rows, elapsed, peak, outputs in results:
+        workbook = os.path.basename(workbook)
+        state["workbooks"][workbook] = dict(
+            pending[workbook],
+            outputs=[os.path.basename(output) for output in outputs])
+
+        peak = "n/a" if peak is None else f"{peak:.0f} MiB"
+        print(
+            f"{workbook}: {rows} rows in {elapsed:.2f}s "
+            f"({rows / elapsed if elapsed else 0:.0f} rows/sec), "
+            f"peak memory {peak}")
+
+    # Outputs of deleted worksheets and workbooks. Those of workbooks that
+    # failed are kept until they convert again
+    current = {
+        output for record in state["workbooks"].values()
+        for output in record["outputs"]
+        }
+    remove_outputs(path, sorted(
+        output for workbook, outputs in old_outputs.items()
+        if workbook not in failed for output in outputs
+        if output not in current))
+
+    save_state(path, state, output_format)
+
+
+def benchmark_formats(rows=BENCHMARK_ROWS):
+    """
+    Compares the CSV and Parquet outputs on a generated workbook with text,
+    integer, float, date and boolean columns, and prints the file size,
+    write time and the time taken to read the file back into an Arrow
+    table. Takes in the number of rows in the generated workbook.
+    """
+
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("Data")
+    ws.append(["Name", "Quantity", "Price", "Date", "Paid"])
+    start_date = datetime.datetime(2018, 6, 1)
+    for number in range(rows):
+        ws.append([
+            f"Item {number % 1000}", number, number * 0.25,
+            start_date + datetime.timedelta(minutes=number), number % 3 == 0])
+    wb.save(BENCHMARK_FILE)
+
+    for output_format in OUTPUT_FORMATS:
+        _, _, elapsed, _, outputs = convert_workbook(
+            BENCHMARK_FILE, True, output_format, header=True)
+
+        start_time = time.perf_counter()
+        if output_format == "parquet":
+            table = pq.read_table(outputs[0])
+        else:
+            table = pa.csv.read_csv(outputs[0], pa.csv.ReadOptions(
+                encoding="UTF-16"))
+        read_time = time.perf_counter() - start_time
+
+        print(
+            f"{output_format:<8}: {os.path.getsize(outputs[0]) / 2 ** 20:7.2f}"
+            f" MiB, write {elapsed:6.2f}s, read {read_time:6.3f}s "
+            f"({table.num_rows} rows)")
+        os.remove(outputs[0])
+
+    os.remove(BENCHMARK_FILE)
+
+
+def main(output_format="csv", header=False):
+    print(f"\n{'Spreadsheet To CSV':>35}")
+    print(f"{'=========== == ===':>35}")
+
+    # Get folder path from user
+    print(f"\nCurrent working directory is {os.getcwd()}:")
+    path = input("Please enter the desired folder path or leave blank to stay in current working directory.\n")
+    if path:
+        os.chdir(path)
+
+    convert_folder(
+        ".", fast=True, output_format=output_format, header=header)
+
+    print("Done.")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "--check":
+        # excel2csv.py --check <workbooks>
+        results = [check_fast_path(workbook) for workbook in sys.argv[2:]]
+        print(f"{sum(results)} of {len(results)} workbooks match.")
+    elif len(sys.argv) > 1 and sys.argv[1] == "--benchmark":
+        # excel2csv.py --benchmark [rows]
+        benchmark_formats(
+            int(sys.argv[2]) if len(sys.argv) > 2 else BENCHMARK_ROWS)
+    elif len(sys.argv) > 1 and sys.argv[1] == "--parquet":
+        # excel2csv.py --parquet [--header]
+        main("parquet", "--header" in sys.argv[2:])
+    else:
+        main()
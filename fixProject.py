@@ -21,60 +21,527 @@
 #
 # Nadia Borsch      misc@nborsch.com        Jun/2018
 
+import contextlib
+import hashlib
+import io
+import json
 import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 from PIL import Image
 
 # Constants
 SQUARE_FIT_SIZE = 1000
 LOGO_DEFAULT_SIZE = 300
+LOGO_WORKERS = os.cpu_count() or 1
+LOGO_CHUNKSIZE = 8
+PIPELINE_QUEUE_SIZE = 16
+PIPELINE_COMPUTE_WORKERS = os.cpu_count() or 1
+PIPELINE_WRITER_WORKERS = 2
+MANIFEST_FILE = "manifest.json"
+# Image modes the logo can be blended into with NumPy
+COMPOSITE_MODES = ("RGB", "RGBA", "L")
 file_ext = ["jpg", "jpeg", "png", "bmp", "gif"]
 
+# Logo used by worker processes, set up by init_worker
+_worker_logo = None
+_worker_logo_arrays = None
+
+# Marks the end of the items handed to a pipeline stage
+_STAGE_DONE = object()
+
 
-def apply_logo(img_folder, new_folder, logo_file):
+def apply_logo(
+        img_folder,
+        new_folder,
+        logo_file,
+        workers=1,
+        chunksize=LOGO_CHUNKSIZE,
+        incremental=True,
+        numpy_composite=False):
     """
     Handles the application of a logo image onto an image. Takes in a string
     with a folder path for the images onto which the logo will be applied
     (img_folder), a string for the folder onto which to save the new images
-    (new_folder), and the path for the logo image file (logo_file).
+    (new_folder), the path for the logo image file (logo_file), and
+    optionally the number of worker processes (workers), the number of
+    files handed to a worker at a time (chunksize), whether images that
+    are up to date in the output manifest are skipped (incremental) and
+    whether the logo is blended with NumPy instead of Image.paste
+    (numpy_composite). Images are processed in the current process if
+    workers is 1.
     """
 
     logo = handle_logo(logo_file)
-    logo_width, logo_height = logo.size
+    filenames, manifest, pending = outdated_images(
+        list_images(img_folder, logo_file), new_folder, logo_file,
+        incremental)
+
+    start_time = time.perf_counter()
+    saved = 0
+
+    with contextlib.ExitStack() as stack:
+        if workers == 1:
+            logo_arrays = prepare_logo(logo) if numpy_composite else None
+            timings = (
+                process_image(filename, logo, new_folder, logo_arrays)
+                for filename in filenames
+                )
+        else:
+            # Logo is prepared once and handed to each worker as raw pixels
+            executor = stack.enter_context(ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=init_worker,
+                initargs=(
+                    logo.mode, logo.size, logo.tobytes(), numpy_composite)))
+            timings = executor.map(
+                process_image_worker,
+                filenames,
+                [new_folder] * len(filenames),
+                chunksize=chunksize)
+
+        try:
+            for timing in timings:
+                if timing is None:
+                    # Image failed, it's processed again on the next run
+                    continue
+
+                filename, seconds = timing
+                basename = os.path.basename(filename)
+                manifest["files"][basename] = dict(
+                    pending[basename], output=seconds is not None)
+
+                if seconds is not None:
+                    saved += 1
+                    print(f"{basename}: {seconds * 1000:.1f}ms")
+
+        finally:
+            # Keep the images finished so far even if the run stops partway
+            save_manifest(new_folder, manifest)
+
+    elapsed = time.perf_counter() - start_time
 
-    for filename in os.listdir("."):
+    print(
+        f"Saved {saved} images in {elapsed:.2f}s "
+        f"({saved / elapsed if elapsed else 0:.1f} images/sec).")
 
-        if not filename.endswith(tuple(file_ext)):
-            # Skip files that are not images
-            continue
 
-        if filename == os.path.basename(logo_file):
-            # Skip applying logo onto logo
-            continue
+def file_hash(filename):
+    """
+    Hashes the contents of a file. Takes in a string with the file path and
+    returns the hex SHA-256 digest of its contents.
+    """
 
-        print(f"Opening file {filename}...")
-        image = Image.open(filename)
-        image_width, image_height = image.size
+    digest = hashlib.sha256()
+
+    with open(filename, "rb") as hashed_file:
+        for block in iter(lambda: hashed_file.read(2 ** 20), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def save_manifest(new_folder, manifest):
+    """
+    Writes the output manifest, replacing the previous one only once the new
+    one is complete. Takes in a string for the folder holding the new images
+    (new_folder) and the manifest dict.
+    """
 
-        if image_width < LOGO_DEFAULT_SIZE and image_height < \
-                LOGO_DEFAULT_SIZE:
-            # Skip files that are not at least twice the width and the height
-            # of the logo
-            print(f"{filename} is too small. Skipping...")
+    manifest_file = os.path.join(new_folder, MANIFEST_FILE)
+
+    with open(manifest_file + ".tmp", "w") as new_manifest:
+        json.dump(manifest, new_manifest, indent=1)
+
+    os.replace(manifest_file + ".tmp", manifest_file)
+
+
+def outdated_images(filenames, new_folder, logo_file, incremental=True):
+    """
+    Checks which images need the logo applied again according to the output
+    manifest kept in new_folder. An image is up to date if its size and mtime
+    (or, failing that, its content hash) match the manifest and its output
+    still exists. Every image is outdated if the logo file or the size
+    settings changed since the manifest was written. Takes in a list of
+    image file paths (filenames), a string for the folder holding the new
+    images (new_folder), the path for the logo image file (logo_file) and
+    whether to check the manifest at all (incremental). Returns the list of
+    image file paths to process, the manifest dict to update, and a dict of
+    source records for the images to process.
+    """
+
+    settings = {
+        "logo_hash": file_hash(logo_file),
+        "square_fit_size": SQUARE_FIT_SIZE,
+        "logo_default_size": LOGO_DEFAULT_SIZE,
+        }
+    manifest = {"settings": settings, "files": {}}
+
+    try:
+        with open(os.path.join(new_folder, MANIFEST_FILE)) as old_manifest:
+            previous = json.load(old_manifest)
+    except (OSError, ValueError):
+        previous = None
+
+    if incremental and previous and previous.get("settings") == settings:
+        old_files = previous["files"]
+    else:
+        # Logo or settings changed, rebuild everything
+        old_files = {}
+
+    outdated = []
+    pending = {}
+
+    for filename in filenames:
+        basename = os.path.basename(filename)
+        stat = os.stat(filename)
+        source = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+        old = old_files.get(basename)
+
+        if old and (old["size"], old["mtime"]) == (
+                source["size"], source["mtime"]):
+            source["hash"] = old["hash"]
+        else:
+            source["hash"] = file_hash(filename)
+
+        if old and old["hash"] == source["hash"] and (
+                not old["output"] or os.path.exists(
+                    os.path.join(new_folder, basename))):
+            # Output is up to date
+            manifest["files"][basename] = dict(source, output=old["output"])
             continue
 
-        if image_width > SQUARE_FIT_SIZE and image_height > SQUARE_FIT_SIZE:
-            # Resize images larger than 1000px
-            image = resize_img(image, SQUARE_FIT_SIZE)
-            image_width, image_height = image.size
+        outdated.append(filename)
+        pending[basename] = source
+
+    print(
+        f"{len(outdated)} of {len(filenames)} images need the logo "
+        "applied.")
+
+    return outdated, manifest, pending
 
-        # Apply logo
-        print(f"Apllying logo onto {filename}...")
+
+def list_images(img_folder, logo_file):
+    """
+    Lists the images onto which the logo will be applied. Takes in a string
+    with the images folder path (img_folder) and the path for the logo image
+    file (logo_file), and returns a list of image file paths.
+    """
+
+    return [
+        os.path.join(img_folder, filename)
+        for filename in os.listdir(img_folder)
+        # Skip files that are not images and skip applying logo onto logo
+        if filename.endswith(tuple(file_ext))
+        and filename != os.path.basename(logo_file)
+        ]
+
+
+def process_image(filename, logo, new_folder, logo_arrays=None):
+    """
+    Applies a logo onto a single image and saves it. Takes in a string with
+    the image file path (filename), the logo Image object (logo), a string
+    for the folder onto which to save the new image (new_folder) and
+    optionally the logo arrays made by prepare_logo (logo_arrays), and
+    returns a tuple with the image file path and the time taken in seconds,
+    which is None if the image was skipped, or None if the image could not
+    be processed.
+    """
+
+    start_time = time.perf_counter()
+    basename = os.path.basename(filename)
+
+    try:
+        print(f"Opening file {basename}...")
+        image = compose_image(
+            Image.open(filename), logo, basename, logo_arrays)
+
+        if image is None:
+            return filename, None
+
+        # Save image with applied logo
+        print(f"Saving {basename}...")
+        image.save(os.path.join(new_folder, basename))
+
+    except Exception as error:
+        # Skip broken or unwritable images, as the pipeline does
+        print(f"Could not process {basename}: {error}")
+        return None
+
+    return filename, time.perf_counter() - start_time
+
+
+def compose_image(image, logo, basename, logo_arrays=None):
+    """
+    Resizes an image if needed and pastes the logo onto its bottom-right
+    corner. Takes in the image and logo Image objects (image, logo), a
+    string with the image filename (basename) and optionally the logo arrays
+    made by prepare_logo (logo_arrays), used to blend the logo with NumPy,
+    and returns the new Image object, or None if the image is too small for
+    the logo.
+    """
+
+    logo_width, logo_height = logo.size
+    image_width, image_height = image.size
+
+    if image_width < LOGO_DEFAULT_SIZE and image_height < \
+            LOGO_DEFAULT_SIZE:
+        # Skip files that are not at least twice the width and the height
+        # of the logo
+        print(f"{basename} is too small. Skipping...")
+        return None
+
+    if image_width > SQUARE_FIT_SIZE and image_height > SQUARE_FIT_SIZE:
+        # Resize images larger than 1000px
+        image = resize_img(image, SQUARE_FIT_SIZE)
+        image_width, image_height = image.size
+
+    # Apply logo
+    print(f"Apllying logo onto {basename}...")
+    if logo_arrays and image.mode in logo_arrays:
+        composite_logo([image], logo_arrays)
+    else:
         image.paste(logo, (
             image_width - logo_width, image_height - logo_height), logo)
 
-        # Save image with applied logo
-        print(f"Saving {filename}...")
-        image.save(os.path.join(new_folder, filename))
+    return image
+
+
+def prepare_logo(logo):
+    """
+    Precomputes the logo for NumPy alpha blending, once for each supported
+    image mode: the logo pixels premultiplied by their alpha and the inverse
+    alpha, both as uint16 arrays. Takes in the logo Image object, which must
+    have an alpha band, and returns a dict of modes to (premultiplied,
+    inverse alpha) tuples.
+    """
+
+    alpha = np.asarray(logo.getchannel("A"), dtype=np.uint16)
+    logo_arrays = {}
+
+    for mode in COMPOSITE_MODES:
+        pixels = np.asarray(logo.convert(mode), dtype=np.uint16)
+        mode_alpha = alpha if pixels.ndim == 2 else alpha[:, :, np.newaxis]
+        # Rounding offset of the division by 255 is folded in
+        logo_arrays[mode] = (pixels * mode_alpha + 128, 255 - mode_alpha)
+
+    return logo_arrays
+
+
+def composite_logo(images, logo_arrays):
+    """
+    Blends the logo into the bottom-right corner of a stack of images of the
+    same size and mode in one vectorized step. Only the logo-sized corner of
+    each image is read and written back. Rounding follows Image.paste, so
+    results are pixel-exact. Takes in a list of Image objects, which are
+    modified in place, and the logo arrays made by prepare_logo.
+    """
+
+    premultiplied, inverse_alpha = logo_arrays[images[0].mode]
+    image_width, image_height = images[0].size
+
+    # Logo is clipped if it's larger than the image
+    logo_height = min(premultiplied.shape[0], image_height)
+    logo_width = min(premultiplied.shape[1], image_width)
+    premultiplied = premultiplied[-logo_height:, -logo_width:]
+    inverse_alpha = inverse_alpha[-logo_height:, -logo_width:]
+    box = (
+        image_width - logo_width, image_height - logo_height,
+        image_width, image_height)
+
+    corners = np.stack([
+        np.asarray(image.crop(box), dtype=np.uint16) for image in images])
+
+    # Same rounded division by 255 as Pillow's blending, done in place
+    corners *= inverse_alpha
+    corners += premultiplied
+    blended = corners >> 8
+    blended += corners
+    blended >>= 8
+    blended = blended.astype(np.uint8)
+
+    for image, corner in zip(images, blended):
+        image.paste(Image.fromarray(corner, image.mode), box[:2])
+
+
+def apply_logo_pipeline(
+        img_folder,
+        new_folder,
+        logo_file,
+        queue_size=PIPELINE_QUEUE_SIZE,
+        compute_workers=PIPELINE_COMPUTE_WORKERS,
+        writer_workers=PIPELINE_WRITER_WORKERS,
+        incremental=True,
+        numpy_composite=False):
+    """
+    Applies a logo onto every image in a folder through a three-stage
+    pipeline, so that reading files, resizing and pasting, and encoding and
+    saving all overlap. A reader thread prefetches file bytes, compute
+    threads resize and paste the logo, and writer threads encode and save
+    the new images. Stages are connected by queues holding at most
+    queue_size items, which caps memory use whatever the folder size. Takes
+    in the same folder, logo, incremental and numpy_composite arguments as
+    apply_logo, the queue size and the number of compute and writer
+    threads, and prints the time spent and the queue depth for each stage.
+    """
+
+    logo = handle_logo(logo_file)
+    filenames, manifest, pending = outdated_images(
+        list_images(img_folder, logo_file), new_folder, logo_file,
+        incremental)
+    logo_arrays = prepare_logo(logo) if numpy_composite else None
+    # Whether each image got an output, filled in by the stages
+    outputs = {}
+
+    def read(filename):
+        with open(filename, "rb") as img_file:
+            return filename, img_file.read()
+
+    def compute(item):
+        filename, data = item
+        basename = os.path.basename(filename)
+        image = compose_image(
+            Image.open(io.BytesIO(data)), logo, basename, logo_arrays)
+        if image is None:
+            outputs[basename] = False
+            return None
+        return basename, image
+
+    def write(item):
+        basename, image = item
+        print(f"Saving {basename}...")
+        image.save(os.path.join(new_folder, basename))
+        outputs[basename] = True
+
+    # Filenames are tiny, so the reader's input queue doesn't need a bound
+    stages = [
+        ("read", read, 1, queue.Queue()),
+        ("compute", compute, compute_workers, queue.Queue(queue_size)),
+        ("write", write, writer_workers, queue.Queue(queue_size)),
+        ]
+
+    for filename in filenames:
+        stages[0][3].put(filename)
+
+    start_time = time.perf_counter()
+    running = []
+
+    for index, (name, func, workers, in_queue) in enumerate(stages):
+        out_queue = stages[index + 1][3] if index + 1 < len(stages) else None
+        stage_stats = [
+            {"items": 0, "time": 0, "depth_sum": 0, "depth_max": 0}
+            for _ in range(workers)
+            ]
+        threads = [
+            threading.Thread(
+                target=run_stage,
+                args=(func, in_queue, out_queue, thread_stats),
+                daemon=True)
+            for thread_stats in stage_stats
+            ]
+        running.append((name, threads, stage_stats))
+
+        for thread in threads:
+            thread.start()
+
+    # Stop each stage once the previous one has drained
+    stages[0][3].put(_STAGE_DONE)
+    for index, (name, threads, _) in enumerate(running):
+        for thread in threads:
+            thread.join()
+        if index + 1 < len(stages):
+            for _ in range(stages[index + 1][2]):
+                stages[index + 1][3].put(_STAGE_DONE)
+
+    elapsed = time.perf_counter() - start_time
+
+    for index, (name, threads, stage_stats) in enumerate(running):
+        items = sum(stats["items"] for stats in stage_stats)
+        busy = sum(stats["time"] for stats in stage_stats)
+        utilisation = busy / len(threads) / elapsed * 100 if elapsed else 0
+        depth_sum = sum(stats["depth_sum"] for stats in stage_stats)
+        depth_max = max(stats["depth_max"] for stats in stage_stats)
+        output = (
+            f", output queue depth avg {depth_sum / items if items else 0:.1f}"
+            f" max {depth_max}/{queue_size}"
+            if index + 1 < len(stages) else "")
+        print(
+            f"Stage {name:<8} {len(threads)} thread(s): {items} items, "
+            f"{busy:.2f}s busy ({utilisation:.0f}% utilisation){output}")
+
+    for basename, output in outputs.items():
+        manifest["files"][basename] = dict(pending[basename], output=output)
+
+    save_manifest(new_folder, manifest)
+
+    saved = sum(1 for output in outputs.values() if output)
+    print(
+        f"Saved {saved} images in {elapsed:.2f}s "
+        f"({saved / elapsed if elapsed else 0:.1f} images/sec).")
+
+
+def run_stage(func, in_queue, out_queue, stats):
+    """
+    Runs one thread of a pipeline stage until it gets the end marker. Takes
+    in the function applied to each item (func), the queues the items are
+    taken from and handed to (in_queue, out_queue, which is None for the
+    last stage) and a dict in which the thread's statistics are collected.
+    """
+
+    while True:
+        item = in_queue.get()
+
+        if item is _STAGE_DONE:
+            break
+
+        start_time = time.perf_counter()
+        try:
+            result = func(item)
+        except Exception as error:
+            # Skip broken or unwritable images without stalling the other
+            # stages, which would wait on this thread forever
+            filename = item if isinstance(item, str) else item[0]
+            print(
+                f"Could not process {os.path.basename(filename)}: {error}")
+            result = None
+        stats["time"] += time.perf_counter() - start_time
+        stats["items"] += 1
+
+        if result is not None and out_queue is not None:
+            # Blocks while the next stage is behind and its queue is full
+            out_queue.put(result)
+            depth = out_queue.qsize()
+            stats["depth_sum"] += depth
+            stats["depth_max"] = max(stats["depth_max"], depth)
+
+
+def init_worker(logo_mode, logo_size, logo_data, numpy_composite=False):
+    """
+    Rebuilds the logo Image object, and its blending arrays if needed, in a
+    worker process. Takes in the logo mode, size and raw pixel data, and
+    whether the logo is blended with NumPy (numpy_composite).
+    """
+
+    global _worker_logo, _worker_logo_arrays
+    _worker_logo = Image.frombytes(logo_mode, logo_size, logo_data)
+    if numpy_composite:
+        _worker_logo_arrays = prepare_logo(_worker_logo)
+
+
+def process_image_worker(filename, new_folder):
+    """
+    Applies the worker's logo onto a single image. Takes in a string with
+    the image file path (filename) and a string for the folder onto which to
+    save the new image (new_folder), and returns the result of process_image.
+    """
+
+    return process_image(
+        filename, _worker_logo, new_folder, _worker_logo_arrays)
 
 
 def handle_logo(logo_file):
@@ -94,13 +561,14 @@ def handle_logo(logo_file):
     return logo
 
 
-def resize_img(img, size):
+def fit_size(img_size, size):
     """
-    Resizes an image (img) according to the provided size. Takes in an Image
-    object (img) and an int (size), and returns the resized Image object.
+    Calculates the dimensions of an image scaled so that its largest side
+    matches the provided size. Takes in a (width, height) tuple (img_size)
+    and an int (size), and returns the scaled (width, height) tuple.
     """
 
-    img_width, img_height = img.size
+    img_width, img_height = img_size
 
     # Logo is larger than 300px and width is larger than height
     if img_width > img_height:
@@ -112,11 +580,182 @@ def resize_img(img, size):
         img_width = int((size / img_height) * img_width)
         img_height = size
 
+    return img_width, img_height
+
+
+def resize_img(img, size, draft=True):
+    """
+    Resizes an image (img) according to the provided size. If the image is a
+    JPEG that hasn't been decoded yet, the decoder is first asked for a
+    reduced-scale decode (1/2, 1/4 or 1/8) no smaller than the target size,
+    so most of the pixels that would be thrown away are never decoded. Takes
+    in an Image object (img), an int (size) and a bool (draft) telling
+    whether to use reduced-scale decoding, and returns the resized Image
+    object.
+    """
+
+    img_width, img_height = fit_size(img.size, size)
+
+    if draft and img.format == "JPEG":
+        img.draft(img.mode, (img_width, img_height))
+
     img = img.resize((img_width, img_height))
 
     return img
 
 
+def benchmark_run(filename, size, draft, repeats):
+    """
+    Runs one resize benchmark case. Takes in an image file path (filename),
+    an int (size), whether to use JPEG draft mode (draft) and the number of
+    runs (repeats), and returns the fastest time in seconds, the decoded
+    image size and the peak resident memory in MiB (None where it can't be
+    measured).
+    """
+
+    best = None
+
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        resize_img(Image.open(filename), size, draft)
+        elapsed = time.perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+
+    # Size the decoder decodes to before resampling
+    img = Image.open(filename)
+    if draft and img.format == "JPEG":
+        img.draft(img.mode, fit_size(img.size, size))
+
+    try:
+        import resource
+    except ImportError:
+        # Windows
+        return best, img.size, None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KiB elsewhere
+    return best, img.size, peak / 2 ** 20 if sys.platform == "darwin" else \
+        peak / 2 ** 10
+
+
+def benchmark_resize(filenames, size=SQUARE_FIT_SIZE, repeats=3):
+    """
+    Compares decoding and resizing images with and without JPEG draft mode,
+    each image run in a fresh process so peak memory isn't carried over
+    between runs. Takes in a list of image file paths (filenames), an int
+    (size) and the number of runs per image (repeats), of which the fastest
+    is kept.
+    """
+
+    totals = {False: [0, 0], True: [0, 0]}
+
+    for filename in filenames:
+        for draft in (False, True):
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                best, (img_width, img_height), peak = executor.submit(
+                    benchmark_run, filename, size, draft, repeats).result()
+
+            totals[draft][0] += best
+            totals[draft][1] = max(totals[draft][1], peak or 0)
+
+            peak = "n/a" if peak is None else f"{peak:.0f} MiB"
+            print(
+                f"{os.path.basename(filename)} "
+                f"{'draft' if draft else 'full '}: {best * 1000:8.1f}ms, "
+                f"decoded {img_width}x{img_height}, peak memory {peak}")
+
+    full_time, full_memory = totals[False]
+    draft_time, draft_memory = totals[True]
+
+    print(
+        f"\nTotal decode and resize time: {full_time:.2f}s full, "
+        f"{draft_time:.2f}s draft "
+        f"({full_time / draft_time if draft_time else 0:.1f}x faster).")
+    if full_memory:
+        print(
+            f"Peak memory: {full_memory:.0f} MiB full, "
+            f"{draft_memory:.0f} MiB draft.")
+
+
+def benchmark_composite(filenames, logo_file, repeats=3):
+    """
+    Compares pasting the logo with Image.paste against NumPy blending, one
+    image at a time and as stacks of same-sized images, and checks that
+    both give the same pixels. Takes in a list of image file paths
+    (filenames), the path for the logo image file (logo_file) and the
+    number of runs (repeats), of which the fastest is kept.
+    """
+
+    logo = handle_logo(logo_file)
+    logo_arrays = prepare_logo(logo)
+    logo_width, logo_height = logo.size
+
+    # Images are decoded and resized beforehand so only compositing is timed
+    images = []
+    for filename in filenames:
+        image = Image.open(filename)
+        if image.width > SQUARE_FIT_SIZE and image.height > SQUARE_FIT_SIZE:
+            image = resize_img(image, SQUARE_FIT_SIZE)
+        if image.mode in logo_arrays:
+            images.append(image.copy())
+
+    stacks = {}
+    for image in images:
+        stacks.setdefault((image.size, image.mode), []).append(image)
+
+    def paste_all():
+        results = [image.copy() for image in images]
+        for image in results:
+            image.paste(logo, (
+                image.width - logo_width, image.height - logo_height), logo)
+        return results
+
+    def numpy_each():
+        results = [image.copy() for image in images]
+        for image in results:
+            composite_logo([image], logo_arrays)
+        return results
+
+    def numpy_stacked():
+        results = []
+        for stack in stacks.values():
+            stack = [image.copy() for image in stack]
+            composite_logo(stack, logo_arrays)
+            results.extend(stack)
+        return results
+
+    pasted = paste_all()
+    for name, func in (
+            ("Image.paste", paste_all),
+            ("NumPy per image", numpy_each),
+            ("NumPy stacked", numpy_stacked)):
+        best = None
+        for _ in range(repeats):
+            start_time = time.perf_counter()
+            results = func()
+            elapsed = time.perf_counter() - start_time
+            best = elapsed if best is None else min(best, elapsed)
+
+        # Stacked results are grouped by size, so compare by identity order
+        order = [id(image) for image in images]
+        if name == "NumPy stacked":
+            expected = [
+                pasted[order.index(id(image))]
+                for stack in stacks.values() for image in stack]
+        else:
+            expected = pasted
+        max_error = max((
+            int(np.abs(
+                np.asarray(result, dtype=np.int16)
+                - np.asarray(reference, dtype=np.int16)).max())
+            for result, reference in zip(results, expected)), default=0)
+
+        print(
+            f"{name:<16}: {best * 1000:8.1f}ms for {len(images)} images "
+            f"({len(images) / best if best else 0:.0f} images/sec), "
+            f"max pixel error {max_error}")
+
+
 def main():
     # Program presentation
     print(f"\n{'Fixed Resize and Add Logo':>50}")
@@ -131,10 +770,9 @@ def main():
 
         if img_folder:
             os.chdir(img_folder)
-            break
-        else:
-            img_folder = os.getcwd
-            break
+
+        img_folder = os.getcwd()
+        break
 
     print(f"Folder path {os.getcwd()} will be used.\n")
 
@@ -156,10 +794,17 @@ def main():
     new_folder = os.path.join(os.getcwd(), "With Logo")
     os.makedirs(new_folder, exist_ok=True)
 
-    apply_logo(img_folder, new_folder, logo_file)
+    apply_logo(img_folder, new_folder, logo_file, workers=LOGO_WORKERS)
 
     print("Done.")
 
 
 if __name__ == '__main__':
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] == "--benchmark":
+        # fixProject.py --benchmark <image files>
+        benchmark_resize(sys.argv[2:])
+    elif len(sys.argv) > 2 and sys.argv[1] == "--benchmark-composite":
+        # fixProject.py --benchmark-composite <logo file> <image files>
+        benchmark_composite(sys.argv[3:], sys.argv[2])
+    else:
+        main()
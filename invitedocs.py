@@ -14,27 +14,281 @@
 # 
 # Nadia Borsch      misc@nborsch.com        Jun/2018
 
+import csv
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
 import docx
 
-# Set up documents and files
-template = docx.Document("template.docx")
-guestlist = open("guests.txt", "r")
-guests = guestlist.readlines()
+# Constants
+TEMPLATE_FILE = "template.docx"
+GUEST_FILE = "guests.txt"
+INVITATIONS_FILE = "invitations.docx"
+DOCUMENT_PART = "word/document.xml"
+STYLES_PART = "word/styles.xml"
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+# Invitation paragraphs and their styles, None stands for the guest name
+INVITATION = [
+    ("It would be a pleasure to have the company of", "Invitation"),
+    (None, "Guest"),
+    ("at 11010 Memory Lane on the evening of", "Invitation"),
+    ("April 1st", "Date"),
+    ("at 7 o’ clock", "Invitation"),
+    ]
+# Guests written to document.xml at a time by the streaming writer
+STREAM_BATCH = 1000
+BENCHMARK_COUNTS = (1000, 10000, 100000)
+SHARD_SIZE = 500
+SHARD_WORKERS = os.cpu_count() or 1
+SHARD_MANIFEST_FILE = "invitations_manifest.csv"
+
+
+def make_invitations(guests, template_file, invitations_file):
+    """
+    Builds the invitations document in memory with python-docx, one
+    invitation per page. Takes in an iterable of guest name lines, the
+    template document path and the invitations document path.
+    """
+
+    template = docx.Document(template_file)
+
+    for guest in guests:
+        # Copy text for each paragraph from template and add styles
+        for text, style in INVITATION:
+            template.add_paragraph(
+                guest.strip("\n") if text is None else text, style=style)
+
+        # Page break to separate invitations
+        template.add_page_break()
+
+    template.save(invitations_file)
+
+
+def paragraph_xml(text, style_id):
+    """
+    Renders a paragraph with the same markup as python-docx's add_paragraph,
+    except that spaces are always preserved. Takes in the paragraph text and
+    the paragraph style ID, and returns the paragraph's XML string.
+    """
+
+    return (
+        f'<w:p><w:pPr><w:pStyle w:val="{style_id}"/></w:pPr><w:r>'
+        f'<w:t xml:space="preserve">{escape(text)}</w:t></w:r></w:p>')
+
+
+def invitation_xml(template):
+    """
+    Pre-renders the XML of an invitation from the template's styles, split
+    around the guest name. Takes in an open template ZipFile object and
+    returns the XML strings that go before and after the escaped guest name.
+    """
+
+    # Style names are mapped to IDs the same way python-docx does it
+    styles = ElementTree.fromstring(template.read(STYLES_PART))
+    style_ids = {
+        style.find(f"{{{W_NS}}}name").get(f"{{{W_NS}}}val"):
+            style.get(f"{{{W_NS}}}styleId")
+        for style in styles.iter(f"{{{W_NS}}}style")
+        if style.find(f"{{{W_NS}}}name") is not None
+        }
 
-for guest in guests:
-    # Copy text for each paragraph from template and add styles
-    template.add_paragraph("It would be a pleasure to have the company of", style="Invitation")
-    template.add_paragraph(guest.strip("\n"), style="Guest")
-    template.add_paragraph("at 11010 Memory Lane on the evening of", style="Invitation")
-    template.add_paragraph("April 1st", style="Date")
-    template.add_paragraph("at 7 o’ clock", style="Invitation")
+    before, after = [], []
+    current = before
+
+    for text, style in INVITATION:
+        if text is None:
+            # Guest paragraph is split where the name goes
+            guest_start, guest_end = paragraph_xml(
+                "\0", style_ids[style]).split("\0")
+            before.append(guest_start)
+            after.append(guest_end)
+            current = after
+        else:
+            current.append(paragraph_xml(text, style_ids[style]))
 
     # Page break to separate invitations
-    template.add_page_break()
-
-# Close and save
-guestlist.close()
-try:
-    template.save("invitations.docx")
-except PermissionError:
-    print("Could not save invitations file, please try again.")
\ No newline at end of file
+    after.append('<w:p><w:r><w:br w:type="page"/></w:r></w:p>')
+
+    return "".join(before), "".join(after)
+
+
+def stream_invitations(guests, template_file, invitations_file):
+    """
+    Writes the invitations document without building it in memory. The
+    template's document.xml is split where python-docx would add
+    paragraphs, and the invitations for each batch of guests are streamed
+    into the new document.xml between both halves. Every other part of the
+    template is copied into the new file untouched. Takes in an iterable of
+    guest name lines, the template document path and the invitations
+    document path, and returns the number of invitations written.
+    """
+
+    count = 0
+
+    with zipfile.ZipFile(template_file) as template, zipfile.ZipFile(
+            invitations_file, "w", zipfile.ZIP_DEFLATED) as invitations:
+        before, after = invitation_xml(template)
+
+        document = template.read(DOCUMENT_PART).decode("utf-8")
+        # New paragraphs go before the body's section properties
+        split = document.rfind("<w:sectPr")
+        if split == -1:
+            split = document.rfind("</w:body>")
+
+        for info in template.infolist():
+            if info.filename != DOCUMENT_PART:
+                invitations.writestr(info, template.read(info))
+                continue
+
+            with invitations.open(
+                    DOCUMENT_PART, "w", force_zip64=True) as part:
+                part.write(document[:split].encode("utf-8"))
+                batch = []
+
+                for guest in guests:
+                    batch.append(before)
+                    batch.append(escape(guest.strip("\n")))
+                    batch.append(after)
+                    count += 1
+
+                    if len(batch) >= STREAM_BATCH * 3:
+                        part.write("".join(batch).encode("utf-8"))
+                        batch = []
+
+                part.write("".join(batch).encode("utf-8"))
+                part.write(document[split:].encode("utf-8"))
+
+    return count
+
+
+def shard_invitations(
+        guest_file,
+        template_file,
+        shard_size=SHARD_SIZE,
+        workers=SHARD_WORKERS):
+    """
+    Splits the guest list into invitation documents of shard_size guests
+    each, written in parallel by worker processes, and saves a CSV manifest
+    listing the document each guest's invitation is in. Takes in the guest
+    list path, the template document path, the number of guests per
+    document and the number of worker processes, and returns the list of
+    documents written.
+    """
+
+    with open(guest_file, "r") as guestlist:
+        guests = [guest.strip("\n") for guest in guestlist]
+
+    base, ext = os.path.splitext(INVITATIONS_FILE)
+    shards = []
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+
+        for number, first in enumerate(range(0, len(guests), shard_size), 1):
+            shard_file = f"{base}_{number:04d}{ext}"
+            shard_guests = guests[first:first + shard_size]
+            shards.append((shard_file, first, shard_guests))
+            futures.append(executor.submit(
+                stream_invitations, shard_guests, template_file, shard_file))
+
+        # Raise any error from the workers
+        for future in futures:
+            future.result()
+
+    with open(SHARD_MANIFEST_FILE, "w", newline="", encoding="utf-8") as \
+            manifest_file:
+        manifest = csv.writer(manifest_file)
+        manifest.writerow(["guest_number", "guest", "document", "page"])
+
+        for shard_file, first, shard_guests in shards:
+            for page, guest in enumerate(shard_guests, 1):
+                manifest.writerow([first + page, guest, shard_file, page])
+
+    return [shard_file for shard_file, _, _ in shards]
+
+
+def benchmark_run(writer, count, template_file):
+    """
+    Runs one benchmark case. Takes in the name of the writer function, the
+    number of guests and the template document path, and returns the time
+    taken in seconds and the peak resident memory in MiB (None where it
+    can't be measured).
+    """
+
+    guests = (f"Guest Number {number}\n" for number in range(count))
+    output = f"benchmark_{writer}_{count}.docx"
+
+    start_time = time.perf_counter()
+    globals()[writer](guests, template_file, output)
+    elapsed = time.perf_counter() - start_time
+    os.remove(output)
+
+    try:
+        import resource
+    except ImportError:
+        # Windows
+        return elapsed, None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KiB elsewhere
+    return elapsed, peak / 2 ** 20 if sys.platform == "darwin" else \
+        peak / 2 ** 10
+
+
+def benchmark_invitations(
+        counts=BENCHMARK_COUNTS,
+        template_file=TEMPLATE_FILE):
+    """
+    Compares the python-docx and streaming writers, each run in a fresh
+    process so peak memory isn't carried over between runs. Takes in the
+    guest counts to test and the template document path.
+    """
+
+    for count in counts:
+        for writer in ("make_invitations", "stream_invitations"):
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                elapsed, peak = executor.submit(
+                    benchmark_run, writer, count, template_file).result()
+
+            peak = "n/a" if peak is None else f"{peak:.0f} MiB"
+            print(
+                f"{count:>7} guests, {writer:<18}: {elapsed:8.2f}s, "
+                f"peak memory {peak}")
+
+
+def main():
+    # Set up documents and files
+    try:
+        with open(GUEST_FILE, "r") as guestlist:
+            count = stream_invitations(
+                guestlist, TEMPLATE_FILE, INVITATIONS_FILE)
+
+        print(f"Saved {count} invitations to {INVITATIONS_FILE}.")
+
+    except PermissionError:
+        print("Could not save invitations file, please try again.")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "--benchmark":
+        # invitedocs.py --benchmark [guest counts]
+        benchmark_invitations(
+            [int(count) for count in sys.argv[2:]] or BENCHMARK_COUNTS)
+    elif len(sys.argv) > 1 and sys.argv[1] == "--shards":
+        # invitedocs.py --shards [guests per document]
+        try:
+            shards = shard_invitations(
+                GUEST_FILE, TEMPLATE_FILE,
+                int(sys.argv[2]) if len(sys.argv) > 2 else SHARD_SIZE)
+            print(
+                f"Saved {len(shards)} invitation documents, listed in "
+                f"{SHARD_MANIFEST_FILE}.")
+        except PermissionError:
+            print("Could not save invitations files, please try again.")
+    else:
+        main()
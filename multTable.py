@@ -11,52 +11,178 @@
 # 
 # Nadia Borsch      misc@nborsch.com        Jun/2018
 
-import openpyxl, os
+import os
+import sys
+import time
+
+import numpy as np
+import openpyxl
 from openpyxl.styles import Font
+from openpyxl.styles import NamedStyle
 
-print(f"\n{'Multiplication Table Maker':>35}")
-print(f"{'============== ===== =====':>35}")
+from spreadsheetIO import MAX_COLUMNS
+from spreadsheetIO import append_rows
+from spreadsheetIO import named_style_cell
+from spreadsheetIO import save_workbook
+
+# Constants
+TABLE_FILE = "multTable.xlsx"
+HEADER_STYLE = "Table Header"
+# Values computed at a time by the streaming writer
+BLOCK_CELLS = 2 ** 20
+# The table takes one more column than N
+MAX_NUMBER = MAX_COLUMNS - 1
+BENCHMARK_NUMBERS = (100, 500, 1000)
+
+
+def make_table(number, table_file=TABLE_FILE):
+    """
+    Builds the multiplication table in memory, cell by cell, and saves it.
+    Takes in the table size N and the spreadsheet path.
+    """
+
+    # Set up worksheet
+    wb = openpyxl.Workbook()
+    sheet = wb["Sheet"]
+
+    # Populate worksheet with results
+    print("Populating multiplication table...")
+    for i in range(1, number + 1):
+
+        # Insert row headers
+        sheet.cell(row=i+1, column=1).value = i
+        sheet.cell(row=i+1, column=1).font = Font(bold=True)
+
+        for j in range(1, number + 1):
+            if i == 1:
+                # Insert column headers
+                sheet.cell(row=i, column=j+1).value = j
+                sheet.cell(row=i, column=j+1).font = Font(bold=True)
+
+            # Insert values
+            sheet.cell(row=i+1, column=j+1).value = i*j
+
+    # Freeze headers
+    sheet.freeze_panes = 'B2'
+
+    print("Saving spreadsheet...")
+    wb.save(table_file)
+
+
+def stream_table(number, table_file=TABLE_FILE):
+    """
+    Writes the multiplication table straight to disk through a write-only
+    workbook, so memory use stays flat whatever the table size. Headers
+    share a single bold named style, and the values are computed a block
+    of rows at a time as a NumPy outer product. Takes in the table size N
+    and the spreadsheet path.
+    """
+
+    if number < 1:
+        raise ValueError("the table needs at least one row and column")
+
+    if number > MAX_NUMBER:
+        raise ValueError(
+            f"the table can't be larger than {MAX_NUMBER}, the columns of a "
+            "spreadsheet")
+
+    wb = openpyxl.Workbook(write_only=True)
+    wb.add_named_style(NamedStyle(HEADER_STYLE, font=Font(bold=True)))
+    sheet = wb.create_sheet("Sheet")
+    styles = {}
+
+    # Freeze headers
+    sheet.freeze_panes = 'B2'
+
+    def header(value):
+        return named_style_cell(sheet, value, HEADER_STYLE, styles)
+
+    def table_rows():
+        # Insert column headers
+        yield [None] + [header(j) for j in range(1, number + 1)]
+
+        columns = np.arange(1, number + 1, dtype=np.int64)
+        block_rows = max(1, BLOCK_CELLS // max(number, 1))
+
+        for first in range(1, number + 1, block_rows):
+            rows = np.arange(
+                first, min(first + block_rows, number + 1), dtype=np.int64)
+
+            # Insert row headers and values
+            for i, values in zip(
+                    rows.tolist(), np.outer(rows, columns).tolist()):
+                yield [header(i)] + values
+
+    print("Populating multiplication table...")
+    append_rows(sheet, table_rows())
 
-# Get number from user
-while True:
-    try:
-        number = int(input("\nEnter an integer for the multiplication table:\n"))
-        if number:
-            break
-    except ValueError:
-        continue
-
-# Set up worksheet
-print(f"\nCreating spreadsheet 'multTable.xlsx' in {os.getcwd()}...")
-wb = openpyxl.Workbook()
-sheet = wb["Sheet"]
-
-# Populate worksheet with results
-print("Populating multiplication table...")
-for i in range(1, number + 1):
-
-    # Insert row headers
-    sheet.cell(row=i+1, column=1).value = i
-    sheet.cell(row=i+1, column=1).font = Font(bold=True)
-    
-    for j in range(1, number + 1):
-        if i == 1:
-            # Insert column headers
-            sheet.cell(row=i, column=j+1).value = j
-            sheet.cell(row=i, column=j+1).font = Font(bold=True) 
-        
-        # Insert values
-        sheet.cell(row=i+1, column=j+1).value = i*j
-
-# Freeze headers
-sheet.freeze_panes = 'A2'
-sheet.freeze_panes = 'B2'
-
-# Save spreadsheet
-try:
     print("Saving spreadsheet...")
-    wb.save("multTable.xlsx")
+    save_workbook(wb, table_file)
+
+
+def benchmark_tables(numbers=BENCHMARK_NUMBERS):
+    """
+    Compares the in-memory and streaming writers and prints the time taken
+    per million cells. Takes in the table sizes to test.
+    """
+
+    for number in numbers:
+        for writer in (make_table, stream_table):
+            start_time = time.perf_counter()
+            writer(number, "benchmark.xlsx")
+            elapsed = time.perf_counter() - start_time
+            os.remove("benchmark.xlsx")
+
+            print(
+                f"N = {number:>5}, {writer.__name__:<12}: {elapsed:8.2f}s, "
+                f"{elapsed / ((number + 1) ** 2 / 10 ** 6):6.2f}s per "
+                "million cells")
+
+
+def main():
+    print(f"\n{'Multiplication Table Maker':>35}")
+    print(f"{'============== ===== =====':>35}")
+
+    if len(sys.argv) > 1:
+        # multTable.py N
+        try:
+            number = int(sys.argv[1])
+        except ValueError:
+            print("\nUsage: multTable.py N, where N is a whole number.")
+            return
+
+    else:
+        # Get number from user
+        while True:
+            try:
+                number = int(input("\nEnter an integer for the multiplication table:\n"))
+                if number > 0:
+                    break
+            except ValueError:
+                continue
+
+    print(f"\nCreating spreadsheet '{TABLE_FILE}' in {os.getcwd()}...")
+
+    # Save spreadsheet
+    try:
+        start_time = time.perf_counter()
+        stream_table(number)
+        elapsed = time.perf_counter() - start_time
+
+        print(
+            f"Done in {elapsed:.2f}s, "
+            f"{elapsed / ((number + 1) ** 2 / 10 ** 6):.2f}s per million "
+            "cells.")
+    except PermissionError:
+        print("\nCOULD NOT SAVE SPREADSHEET, PLEASE TRY AGAIN.")
+    except ValueError as error:
+        print(f"\nCOULD NOT CREATE SPREADSHEET: {error}")
+
 
-    print("Done.")
-except PermissionError:
-    print("\nCOULD NOT SAVE SPREADSHEET, PLEASE TRY AGAIN.")
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "--benchmark":
+        # multTable.py --benchmark [N ...]
+        benchmark_tables(
+            [int(number) for number in sys.argv[2:]] or BENCHMARK_NUMBERS)
+    else:
+        main()
@@ -20,50 +20,720 @@
 #
 # Nadia Borsch      misc@nborsch.com        Jun/2018
 
+import argparse
+import json
 import os
+import sqlite3
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
 from PIL import Image
 
 # Constants
 MIN_PHOTO_SIZE = 500
+PHOTO_EXT = ("jpg", "jpeg", "png")
+PHOTO_THRESHOLD = 0.5
+SCAN_WORKERS = 16
+INDEX_FILE = "photoFolders.sqlite"
+HASH_METHOD = "dhash"
+HASH_BATCH = 256
+DUPLICATE_DISTANCE = 4
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# JPEG Start Of Frame markers carrying the image dimensions (C4, C8 and CC
+# are DHT, JPG and DAC and don't)
+JPEG_SOF_MARKERS = {
+    0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+    0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF
+    }
+
+# Per-thread connections to the scan index
+_index_local = threading.local()
+
+
+def read_image_size(path):
+    """
+    Reads the width and height of a JPEG or PNG image by parsing only its
+    header, without decoding the image. Takes in a string representing the
+    image file path and returns a (width, height) tuple, or None if the file
+    can't be read or isn't a valid JPEG or PNG file.
+    """
+
+    try:
+        with open(path, "rb") as img_file:
+            head = img_file.read(24)
+
+            # PNG: width and height are the first fields of the IHDR chunk
+            if head.startswith(PNG_SIGNATURE) and head[12:16] == b"IHDR":
+                return struct.unpack(">II", head[16:24])
+
+            if not head.startswith(b"\xff\xd8"):
+                # Neither PNG nor JPEG
+                return None
+
+            # JPEG: hop from segment to segment until a SOF marker is found
+            img_file.seek(2)
+            while True:
+                marker = img_file.read(2)
+                if len(marker) < 2 or marker[0] != 0xFF:
+                    return None
+
+                if marker[1] == 0xFF:
+                    # Fill byte, marker starts one byte later
+                    img_file.seek(-1, os.SEEK_CUR)
+                    continue
+
+                length = img_file.read(2)
+                if len(length) < 2:
+                    return None
+                length = struct.unpack(">H", length)[0]
+
+                if marker[1] in JPEG_SOF_MARKERS:
+                    sof = img_file.read(5)
+                    if len(sof) < 5:
+                        return None
+                    img_height, img_width = struct.unpack(">HH", sof[1:5])
+                    return img_width, img_height
+
+                # Skip the rest of the segment
+                img_file.seek(length - 2, os.SEEK_CUR)
+
+    except OSError:
+        return None
+
+
+def is_photo(path, min_size=MIN_PHOTO_SIZE):
+    """
+    Checks whether an image file is large enough to be considered a photo.
+    Takes in a string representing the image file path and an int for the
+    minimum photo size, and returns True or False, or None if the image size
+    could not be read.
+    """
+
+    img_size = read_image_size(path)
+
+    if img_size is None:
+        return None
+
+    img_width, img_height = img_size
+
+    return not (img_width < min_size and img_height < min_size)
+
+
+def open_index(index_file):
+    """
+    Opens (and creates if needed) the SQLite index used to skip unchanged
+    folders between scans. Takes in a string representing the index file
+    path and returns a sqlite3 Connection object.
+    """
+
+    conn = sqlite3.connect(index_file, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS folders ("
+        "path TEXT PRIMARY KEY, mtime INTEGER, photo_files INTEGER, "
+        "other_files INTEGER, checked_files INTEGER, bytes INTEGER, "
+        "subfolders TEXT, min_size INTEGER)")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS files ("
+        "folder TEXT, name TEXT, size INTEGER, mtime INTEGER, photo INTEGER, "
+        "PRIMARY KEY (folder, name))")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS hashes ("
+        "path TEXT, method TEXT, size INTEGER, mtime INTEGER, hash INTEGER, "
+        "PRIMARY KEY (path, method))")
+    conn.commit()
+
+    return conn
+
+
+def index_connection(index_file):
+    """
+    Returns the calling thread's read connection to the index, opening it on
+    first use. Takes in a string representing the index file path and
+    returns a sqlite3 Connection object.
+    """
+
+    connections = _index_local.__dict__.setdefault("connections", {})
+
+    if index_file not in connections:
+        connections[index_file] = sqlite3.connect(index_file, timeout=30)
+
+    return connections[index_file]
+
+
+def load_folder(index_file, foldername):
+    """
+    Looks up the indexed results of a previous scan for a folder. Each
+    worker thread keeps its own connection to the index. Takes in strings
+    representing the index file path and the folder path, and returns a
+    folder record dict, or None if the folder isn't indexed.
+    """
+
+    row = index_connection(index_file).execute(
+        "SELECT mtime, photo_files, other_files, checked_files, bytes, "
+        "subfolders, min_size FROM folders WHERE path = ?",
+        (foldername,)).fetchone()
+
+    if row is None:
+        return None
+
+    return {
+        "path": foldername,
+        "mtime": row[0],
+        "photo_files": row[1],
+        "other_files": row[2],
+        "checked_files": row[3],
+        "bytes": row[4],
+        "subfolders": json.loads(row[5]),
+        "min_size": row[6],
+        "files": None,
+        "changed": False,
+        }
+
+
+def load_files(index_file, foldername):
+    """
+    Loads the indexed per-file results for a folder. Takes in strings
+    representing the index file path and the folder path, and returns a
+    dict of filenames to (size, mtime, photo) tuples.
+    """
+
+    rows = index_connection(index_file).execute(
+        "SELECT name, size, mtime, photo FROM files WHERE folder = ?",
+        (foldername,))
+
+    return {name: (size, mtime, photo) for name, size, mtime, photo in rows}
+
+
+def save_folder(conn, record):
+    """
+    Stores the results of a folder scan in the index, replacing any previous
+    results for that folder. Takes in a sqlite3 Connection object and a
+    folder record dict.
+    """
+
+    conn.execute(
+        "INSERT OR REPLACE INTO folders VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (
+            record["path"], record["mtime"], record["photo_files"],
+            record["other_files"], record["checked_files"], record["bytes"],
+            json.dumps(record["subfolders"]), record["min_size"]))
+    conn.execute("DELETE FROM files WHERE folder = ?", (record["path"],))
+    conn.executemany(
+        "INSERT INTO files VALUES (?, ?, ?, ?, ?)",
+        ((record["path"], name, size, mtime, photo)
+         for name, (size, mtime, photo) in record["files"].items()))
+
+
+def prune_index(conn, hdd, visited):
+    """
+    Removes folders that no longer exist under the scanned tree from the
+    index. Takes in a sqlite3 Connection object, a string representing the
+    scanned root and a set of the folder paths visited in the scan.
+    """
+
+    stale = [
+        (path,) for (path,) in conn.execute("SELECT path FROM folders")
+        if (path == hdd or path.startswith(os.path.join(hdd, "")))
+        and path not in visited
+        ]
+
+    conn.executemany("DELETE FROM folders WHERE path = ?", stale)
+    conn.executemany("DELETE FROM files WHERE folder = ?", stale)
+
+
+def scan_folder(foldername, index_file=None, min_size=MIN_PHOTO_SIZE):
+    """
+    Counts the photo files and other files in a single folder. If an index
+    is used and the folder's mtime hasn't changed since it was indexed, the
+    indexed results are returned without reading the folder, and only files
+    whose size or mtime changed are checked again otherwise. Takes in a
+    string representing the folder path, an optional string for the index
+    file path and an int for the minimum photo size, and returns a folder
+    record dict.
+    """
+
+    record = {
+        "path": foldername,
+        "mtime": None,
+        "photo_files": 0,
+        "other_files": 0,
+        "checked_files": 0,
+        "bytes": 0,
+        "subfolders": [],
+        "min_size": min_size,
+        "files": {},
+        "changed": True,
+        }
+
+    try:
+        record["mtime"] = os.stat(foldername).st_mtime_ns
+        cached = load_folder(index_file, foldername) if index_file else None
+
+        if cached and cached["min_size"] != min_size:
+            # Indexed results were obtained with another minimum photo size
+            cached = None
+
+        if cached and cached["mtime"] == record["mtime"]:
+            # Folder is unchanged since the last scan
+            return cached
+
+        entries = list(os.scandir(foldername))
+    except OSError:
+        # Folder can't be read (permissions, removed during scan...). It's
+        # left out of the index, so that it's scanned again next time
+        record["mtime"] = None
+        return record
+
+    cached_files = load_files(index_file, foldername) if cached else {}
+
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                record["subfolders"].append(entry.path)
+                continue
+
+            stat = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+
+        record["checked_files"] += 1
+        record["bytes"] += stat.st_size
+
+        cached_file = cached_files.get(entry.name)
+
+        if cached_file and cached_file[:2] == (stat.st_size, stat.st_mtime_ns):
+            # File is unchanged since the last scan
+            photo = cached_file[2]
+        elif not entry.name.lower().endswith(PHOTO_EXT):
+            # File is not a photo file
+            photo = False
+        else:
+            photo = is_photo(entry.path, min_size)
+
+        record["files"][entry.name] = (stat.st_size, stat.st_mtime_ns, photo)
+
+        if photo is None:
+            # File is invalid or unreadable
+            continue
+
+        if not photo:
+            # File is not large enough to be considered a photo
+            record["other_files"] += 1
+            continue
+
+        record["photo_files"] += 1
+
+    return record
+
+
+def iter_folder_records(
+        root,
+        min_size=MIN_PHOTO_SIZE,
+        workers=SCAN_WORKERS,
+        index_file=None,
+        stats=None,
+        with_files=False):
+    """
+    Walks a directory tree and yields the record of each folder as soon as
+    that folder has been scanned. Folders are scanned concurrently by a pool
+    of worker threads. If an index file is provided, folders that didn't
+    change since the last scan are not read again. Takes in a string
+    representing the root folder, an int for the minimum photo size, an int
+    for the number of workers, an optional string for the index file path,
+    an optional dict that is filled with scan statistics and a bool telling
+    whether per-file results must be loaded for unchanged folders too.
+    Yields folder record dicts.
+    """
+
+    if stats is None:
+        stats = {}
+    stats.update(files=0, folders=0, changed_folders=0)
+
+    visited = set()
+    conn = open_index(index_file) if index_file else None
+    executor = ThreadPoolExecutor(max_workers=workers)
+
+    try:
+        pending = {
+            executor.submit(scan_folder, root, index_file, min_size): root}
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                foldername = pending.pop(future)
+                record = future.result()
+                visited.add(foldername)
+                stats["folders"] += 1
+                stats["files"] += record["checked_files"]
+
+                # Queue subfolders as soon as they are discovered
+                for subfolder in record["subfolders"]:
+                    pending[executor.submit(
+                        scan_folder, subfolder, index_file, min_size)] = \
+                        subfolder
+
+                if record["changed"]:
+                    stats["changed_folders"] += 1
+                    if conn and record["mtime"] is not None:
+                        save_folder(conn, record)
+                elif with_files:
+                    record["files"] = load_files(index_file, foldername)
+
+                yield record
 
+        if conn:
+            prune_index(conn, root, visited)
 
-def scan_hdd(hdd):
+    finally:
+        # Stop scanning if the consumer stops early
+        executor.shutdown(cancel_futures=True)
+
+        if conn:
+            conn.commit()
+            conn.close()
+
+
+def iter_photo_folders(
+        root,
+        min_size=MIN_PHOTO_SIZE,
+        threshold=PHOTO_THRESHOLD,
+        workers=SCAN_WORKERS,
+        index_file=None,
+        stats=None):
+    """
+    Walks a directory tree and yields a record for each folder in which more
+    than the threshold fraction of files are image files (png or jpg) larger
+    than min_size, as soon as that folder has been scanned. Takes in a string
+    representing the root folder, an int for the minimum photo size, a float
+    for the photo threshold, an int for the number of workers, an optional
+    string for the index file path and an optional dict that is filled with
+    scan statistics. Yields dicts with the folder path, number of photo
+    files, total number of files and total size in bytes.
+    """
+
+    for record in iter_folder_records(
+            root, min_size, workers, index_file, stats):
+        photo_files = record["photo_files"]
+        total_files = photo_files + record["other_files"]
+
+        if total_files and photo_files > total_files * threshold:
+            yield {
+                "path": record["path"],
+                "photo_files": photo_files,
+                "total_files": total_files,
+                "bytes": record["bytes"],
+                }
+
+
+def scan_hdd(hdd, workers=SCAN_WORKERS, index_file=None):
     """
     Walks a directory tree and identifies folders for which more than half of
     the total files are image files (png or jpg) larger than 500px, and prints
-    the fodler path onto stdout if so. Takes in a string representing an HDD
-    letter.
+    the folder path onto stdout if so. Takes in a string representing an HDD
+    letter, an int for the number of workers and an optional string for the
+    index file path, and returns a list of the photo folders found.
     """
 
-    for foldername, subfolders, filenames in os.walk(hdd):
+    photo_folders = []
+    stats = {}
+    start_time = time.perf_counter()
 
-        photo_files = 0
-        other_files = 0
+    for folder in iter_photo_folders(
+            hdd, workers=workers, index_file=index_file, stats=stats):
+        print(folder["path"])
+        photo_folders.append(folder["path"])
 
-        # Check files in current folder
-        for filename in filenames:
-            if not filename.lower().endswith(("jpg", "jpeg", "png")):
-                # File is not a photo file
-                other_files += 1
-                continue
+    print_stats(stats, time.perf_counter() - start_time)
+
+    return photo_folders
+
+
+def print_stats(stats, elapsed, file=sys.stdout):
+    """
+    Prints the throughput of a scan. Takes in a dict of scan statistics, a
+    float for the elapsed time in seconds and an optional file object to
+    print to.
+    """
+
+    print(
+        f"\nScanned {stats['files']} files in {elapsed:.2f}s "
+        f"({stats['files'] / elapsed if elapsed else 0:.0f} files/sec), "
+        f"{stats['changed_folders']} of {stats['folders']} folders changed.",
+        file=file)
 
-            try:
-                img = Image.open(filename)
-            except FileNotFoundError:
-                # Filename is invalid
+
+def load_thumbnail(path, size):
+    """
+    Decodes an image straight into a small grayscale thumbnail, letting the
+    JPEG decoder downscale while decoding. Takes in a string representing
+    the image file path and a (width, height) tuple, and returns a uint8
+    NumPy array of shape (height, width), or None if the image can't be read.
+    """
+
+    try:
+        with Image.open(path) as img:
+            img.draft("L", (size[0] * 8, size[1] * 8))
+            return np.asarray(img.convert("L").resize(size, Image.BOX))
+    except (OSError, ValueError):
+        return None
+
+
+def hash_thumbnails(thumbnails, method=HASH_METHOD):
+    """
+    Computes the perceptual hashes of a batch of thumbnails in one vectorized
+    step. The average hash compares each pixel to the thumbnail mean and the
+    difference hash compares each pixel to its right neighbour. Takes in a
+    uint8 NumPy array of shape (N, 8, 8), or (N, 8, 9) for the difference
+    hash, and a string for the hash method, and returns a list of N 64-bit
+    ints.
+    """
+
+    if method == "dhash":
+        bits = thumbnails[:, :, 1:] > thumbnails[:, :, :-1]
+    else:
+        bits = thumbnails > thumbnails.mean(axis=(1, 2), keepdims=True)
+
+    packed = np.packbits(bits.reshape(len(thumbnails), 64), axis=1)
+
+    return packed.view(">u8").ravel().tolist()
+
+
+def hash_photos(photos, method=HASH_METHOD, index_file=None,
+                workers=SCAN_WORKERS):
+    """
+    Computes the perceptual hash of each photo, in batches of HASH_BATCH.
+    Hashes stored in the index for an unchanged file (same size and mtime)
+    are reused. Takes in a list of (path, size, mtime) tuples, a string for
+    the hash method, an optional string for the index file path and an int
+    for the number of thumbnails decoded at the same time, and returns a
+    dict of paths to hashes.
+    """
+
+    size = (9, 8) if method == "dhash" else (8, 8)
+    hashes = {}
+    conn = open_index(index_file) if index_file else None
+    to_hash = []
+
+    for path, file_size, file_mtime in photos:
+        row = conn.execute(
+            "SELECT size, mtime, hash FROM hashes WHERE path = ? AND "
+            "method = ?", (path, method)).fetchone() if conn else None
+
+        if row and row[:2] == (file_size, file_mtime):
+            # SQLite integers are signed
+            hashes[path] = row[2] % (1 << 64)
+        else:
+            to_hash.append((path, file_size, file_mtime))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for batch_start in range(0, len(to_hash), HASH_BATCH):
+            batch = to_hash[batch_start:batch_start + HASH_BATCH]
+            thumbnails = executor.map(
+                load_thumbnail, (path for path, _, _ in batch),
+                (size for _ in batch))
+
+            # Drop images that couldn't be decoded
+            loaded = [
+                (photo, thumbnail) for photo, thumbnail in zip(
+                    batch, thumbnails) if thumbnail is not None]
+            if not loaded:
                 continue
 
-            img_width, img_height = img.size
+            batch_hashes = hash_thumbnails(
+                np.stack([thumbnail for _, thumbnail in loaded]), method)
+
+            for (path, file_size, file_mtime), img_hash in zip(
+                    (photo for photo, _ in loaded), batch_hashes):
+                hashes[path] = img_hash
 
-            if img_width < MIN_PHOTO_SIZE and img_height < MIN_PHOTO_SIZE:
-                # File is not large enough to be considered a photo
-                other_files += 1
+                if conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO hashes VALUES "
+                        "(?, ?, ?, ?, ?)", (
+                            path, method, file_size, file_mtime,
+                            img_hash - (1 << 64) if img_hash >= 1 << 63
+                            else img_hash))
+
+            if conn:
+                conn.commit()
+
+    if conn:
+        conn.close()
+
+    return hashes
+
+
+def bk_add(tree, img_hash, path):
+    """
+    Adds a photo to a BK-tree of hashes, where each node's children are
+    keyed by their Hamming distance to it. Photos with identical hashes
+    share a node. Takes in a BK-tree dict (empty for a new tree), an int
+    representing the photo hash and a string for the photo path.
+    """
+
+    if not tree:
+        tree.update(hash=img_hash, paths=[path], children={})
+        return
+
+    node = tree
+    while True:
+        distance = (node["hash"] ^ img_hash).bit_count()
+
+        if distance == 0:
+            node["paths"].append(path)
+            return
+
+        if distance not in node["children"]:
+            node["children"][distance] = {
+                "hash": img_hash, "paths": [path], "children": {}}
+            return
+
+        node = node["children"][distance]
+
+
+def bk_search(tree, img_hash, max_distance):
+    """
+    Finds the nodes of a BK-tree within a Hamming distance of a hash. By the
+    triangle inequality, only children whose distance to their parent is
+    within max_distance of the parent's own distance need to be visited.
+    Takes in a BK-tree dict, an int representing the hash and an int for
+    the maximum distance. Yields (node, distance) tuples.
+    """
+
+    stack = [tree] if tree else []
+
+    while stack:
+        node = stack.pop()
+        distance = (node["hash"] ^ img_hash).bit_count()
+
+        if distance <= max_distance:
+            yield node, distance
+
+        for child_distance, child in node["children"].items():
+            if abs(child_distance - distance) <= max_distance:
+                stack.append(child)
+
+
+def iter_bk_nodes(tree):
+    """
+    Yields every node of a BK-tree. Takes in a BK-tree dict.
+    """
+
+    stack = [tree] if tree else []
+
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(node["children"].values())
+
+
+def find_duplicates(
+        root,
+        max_distance=DUPLICATE_DISTANCE,
+        method=HASH_METHOD,
+        min_size=MIN_PHOTO_SIZE,
+        workers=SCAN_WORKERS,
+        index_file=None,
+        stats=None):
+    """
+    Finds duplicate and near-duplicate photos in a directory tree by
+    comparing perceptual hashes. Instead of comparing every pair of photos,
+    hashes are indexed in a BK-tree that is queried once per distinct hash.
+    Takes in a string representing the root folder, an int for the maximum
+    Hamming distance between near-duplicates, a string for the hash method
+    ("dhash" or "ahash"), an int for the minimum photo size, an int for the
+    number of workers, an optional string for the index file path and an
+    optional dict that is filled with scan statistics. Yields dicts with both
+    photo paths and their distance.
+    """
+
+    photos = []
+
+    for record in iter_folder_records(
+            root, min_size, workers, index_file, stats, with_files=True):
+        for name, (file_size, file_mtime, photo) in record["files"].items():
+            if photo:
+                photos.append((
+                    os.path.join(record["path"], name), file_size, file_mtime))
+
+    hashes = hash_photos(photos, method, index_file, workers)
+
+    tree = {}
+    for path, img_hash in hashes.items():
+        bk_add(tree, img_hash, path)
+
+    for node in iter_bk_nodes(tree):
+        # Photos sharing a node are exact hash matches
+        for i, path_a in enumerate(node["paths"]):
+            for path_b in node["paths"][i + 1:]:
+                yield {"path_a": path_a, "path_b": path_b, "distance": 0}
+
+        for match, distance in bk_search(tree, node["hash"], max_distance):
+            if match["hash"] <= node["hash"]:
+                # Same node, or pair already reported from the other side
                 continue
 
-            photo_files += 1
+            for path_a in node["paths"]:
+                for path_b in match["paths"]:
+                    yield {
+                        "path_a": path_a, "path_b": path_b,
+                        "distance": distance}
+
+
+def cli(args):
+    """
+    Non-interactive entry point that streams the photo folders (or pairs of
+    duplicate photos) found as JSON lines onto stdout, one line per result,
+    and the scan statistics onto stderr. Takes in a list of command line
+    arguments.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Find photo folders and print them as JSON lines.")
+    parser.add_argument("root", help="folder to scan")
+    parser.add_argument(
+        "--min-size", type=int, default=MIN_PHOTO_SIZE,
+        help="minimum width or height for a photo, in pixels")
+    parser.add_argument(
+        "--threshold", type=float, default=PHOTO_THRESHOLD,
+        help="fraction of a folder's files that must be photos")
+    parser.add_argument(
+        "--workers", type=int, default=SCAN_WORKERS,
+        help="number of folders scanned at the same time")
+    parser.add_argument(
+        "--index", default=None, help="index file used to skip unchanged "
+        "folders")
+    parser.add_argument(
+        "--duplicates", type=int, metavar="DISTANCE", default=None,
+        help="print pairs of near-duplicate photos within this Hamming "
+        "distance instead of photo folders")
+    parser.add_argument(
+        "--hash", choices=("dhash", "ahash"), default=HASH_METHOD,
+        help="perceptual hash used to find duplicates")
+    args = parser.parse_args(args)
+
+    stats = {}
+    start_time = time.perf_counter()
+
+    if args.duplicates is not None:
+        results = find_duplicates(
+            args.root, args.duplicates, args.hash, args.min_size,
+            args.workers, args.index, stats)
+    else:
+        results = iter_photo_folders(
+            args.root, args.min_size, args.threshold, args.workers,
+            args.index, stats)
+
+    for result in results:
+        # Flush each line so consumers can start on it right away
+        print(json.dumps(result), flush=True)
 
-        if photo_files > (photo_files + other_files) / 2:
-            print(foldername)
+    print_stats(stats, time.perf_counter() - start_time, file=sys.stderr)
 
 
 def main():
@@ -101,7 +771,7 @@ def main():
         while True:
             input("Press ENTER to start the scan.\n")
 
-            scan_hdd(hdd)
+            scan_hdd(hdd, index_file=INDEX_FILE)
 
             print("\nScan finished.")
             break
@@ -113,4 +783,7 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    if len(sys.argv) > 1:
+        cli(sys.argv[1:])
+    else:
+        main()
@@ -12,47 +12,171 @@
 # 
 # Nadia Borsch      misc@nborsch.com        Jun/2018
 
-import openpyxl, os
+import array
+import contextlib
+import os
+import tempfile
+
 from openpyxl.utils import get_column_letter
 
-print(f"\n{'Spreadsheet to Text Files':>40}")
-print(f"{'~~~~~~~~~~~ ~~ ~~~~ ~~~~~':>40}")
-
-# Get folder path from user
-print(f"\nCurrent working directory is {os.getcwd()}:")
-path = input("Please enter the desired folder path or leave blank to stay in current working directory.\n")
-if path:
-    os.chdir(path)
-
-# Get file name from user
-while True:
-    spreadsheet = input("\nPlease enter the filename for the spreadsheet to be converted:\n")
-    if spreadsheet.endswith(".xlsx"):
-        break
-
-print(f"\nThe data on the active sheet in {os.path.join(os.getcwd(), spreadsheet)} will be converted to text files.")
-
-# Open workbook/worksheet
-wb = openpyxl.load_workbook(spreadsheet)
-sheet = wb.active
-
-# Traverse spreadsheet
-for column_count, column in enumerate(sheet.columns, 1):
-
-    # Filename is first row in column
-    filename = sheet.cell(row=1, column=column_count).value
-    txt_file = open(f"{filename}.txt", "w")
-    print(f"Saving column {get_column_letter(column_count)} to '{filename}.txt'...")
-    
-    for row in range(1, len(column) + 1):
-        row_content = sheet.cell(row=row, column=column_count).value
-
-        if row_content:
-            txt_file.write(f"{row_content}\n")
-        else:
-            # Cell is empty, but there are still more rows to traverse
-            txt_file.write("\n")
-    
-    txt_file.close()
-
-print("Done.")
\ No newline at end of file
+from spreadsheetIO import open_file_limit
+from spreadsheetIO import read_worksheet
+
+# Constants
+# Lines of the columns past the open file limit held in memory before
+# they are spilled to disk
+SPILL_BLOCK_CELLS = 2 ** 20
+
+
+def column_line(value):
+    """
+    Turns a cell value into a line of its column's text file. Takes in the
+    cell value and returns the line.
+    """
+
+    if value:
+        return f"{value}\n"
+    else:
+        # Cell is empty, but there are still more rows to traverse
+        return "\n"
+
+
+def spill_block(block, spill_file):
+    """
+    Appends the lines of a block of rows to the spill file column by
+    column. Takes in a list with the list of lines of each spilled column
+    and the open binary spill file, and returns an array of the file
+    offsets where each column starts, followed by the offset where the
+    block ends.
+    """
+
+    offsets = array.array("q")
+
+    for lines in block:
+        offsets.append(spill_file.tell())
+        spill_file.write("".join(lines).encode("utf-8"))
+
+    offsets.append(spill_file.tell())
+
+    return offsets
+
+
+def split_columns(spreadsheet, open_files=None, block_cells=SPILL_BLOCK_CELLS):
+    """
+    Writes each column of the active sheet of a spreadsheet to a text file
+    named after the column's first cell, in a single row by row pass over
+    the sheet as it is streamed from the xlsx package. One buffered file per
+    column is kept open and each cell is appended to it as the rows stream
+    by. Columns past the open file limit are instead collected in blocks,
+    spilled to a temporary file and put together at the end. Files are
+    written to a temporary folder first and renamed in column order, so a
+    later column with the same name replaces an earlier one, as before.
+    Takes in the spreadsheet filename, the number of files to keep open (the
+    process's limit by default) and the number of cells per spilled block,
+    and returns the list of text files written.
+    """
+
+    if open_files is None:
+        open_files = open_file_limit()
+
+    filenames = []
+
+    with tempfile.TemporaryDirectory(dir=os.getcwd()) as temp_folder, \
+            tempfile.TemporaryFile() as spill_file:
+
+        with contextlib.ExitStack() as stack:
+            column_files = []
+            blocks = []
+            block = []
+            cells = 0
+
+            for row_number, row in enumerate(
+                    read_worksheet(spreadsheet, fast=True), 1):
+
+                # Columns are named after their first cell
+                for value in row[len(filenames):]:
+                    filenames.append(
+                        f"{value if row_number == 1 else None}.txt")
+
+                    # Columns starting below the first row
+                    blank_lines = "\n" * (row_number - 1)
+                    if len(column_files) < open_files:
+                        column_files.append(stack.enter_context(open(
+                            os.path.join(
+                                temp_folder, f"{len(column_files)}.txt"),
+                            "w")))
+                        column_files[-1].write(blank_lines)
+                    else:
+                        block.append([blank_lines])
+
+                for column, value in enumerate(row):
+                    if column < open_files:
+                        column_files[column].write(column_line(value))
+                    else:
+                        block[column - open_files].append(
+                            column_line(value))
+                        cells += 1
+
+                # Rows shorter than the sheet
+                for column in range(len(row), len(filenames)):
+                    if column < open_files:
+                        column_files[column].write("\n")
+                    else:
+                        block[column - open_files].append("\n")
+                        cells += 1
+
+                if cells >= block_cells:
+                    blocks.append(spill_block(block, spill_file))
+                    block = [[] for _ in block]
+                    cells = 0
+
+            if block:
+                blocks.append(spill_block(block, spill_file))
+
+        for column, filename in enumerate(filenames):
+            print(
+                f"Saving column {get_column_letter(column + 1)} to "
+                f"'{filename}'...")
+            column_path = os.path.join(temp_folder, f"{column}.txt")
+
+            if column >= open_files:
+                # Put the spilled column back together
+                spilled = column - open_files
+                with open(column_path, "w") as txt_file:
+                    for offsets in blocks:
+                        if spilled < len(offsets) - 1:
+                            spill_file.seek(offsets[spilled])
+                            txt_file.write(spill_file.read(
+                                offsets[spilled + 1] - offsets[spilled]
+                                ).decode("utf-8"))
+
+            os.replace(column_path, filename)
+
+    return filenames
+
+
+def main():
+    print(f"\n{'Spreadsheet to Text Files':>40}")
+    print(f"{'~~~~~~~~~~~ ~~ ~~~~ ~~~~~':>40}")
+
+    # Get folder path from user
+    print(f"\nCurrent working directory is {os.getcwd()}:")
+    path = input("Please enter the desired folder path or leave blank to stay in current working directory.\n")
+    if path:
+        os.chdir(path)
+
+    # Get file name from user
+    while True:
+        spreadsheet = input("\nPlease enter the filename for the spreadsheet to be converted:\n")
+        if spreadsheet.endswith(".xlsx"):
+            break
+
+    print(f"\nThe data on the active sheet in {os.path.join(os.getcwd(), spreadsheet)} will be converted to text files.")
+
+    split_columns(spreadsheet)
+
+    print("Done.")
+
+
+if __name__ == '__main__':
+    main()
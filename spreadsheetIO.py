@@ -0,0 +1,919 @@
+#! python3
+# -*- coding: utf-8 -*-
+#
+# Shared spreadsheet reading and writing for the openpyxl Practice
+# Projects from "Automate The Boring Stuff", by Al Sweigart,
+# Chapters 12 and 14.
+#
+# Rows are streamed from read-only workbooks or straight from the xlsx
+# package, and written through write-only workbooks, so the scripts
+# never hold a whole spreadsheet in memory.
+#
+# Write-only workbooks can't copy a sheet's layout, so read_layout and
+# copy_layout use openpyxl internals, written against openpyxl 3.1.
+# check_openpyxl tells when an openpyxl version no longer has them.
+
+import contextlib
+import hashlib
+import io
+import os
+import posixpath
+import re
+import sys
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from copy import copy
+from xml.etree import ElementTree
+
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.read_only import EMPTY_CELL
+from openpyxl.cell.read_only import ReadOnlyCell
+from openpyxl.formula.translate import Translator
+from openpyxl.styles.numbers import BUILTIN_FORMATS
+from openpyxl.styles.numbers import is_date_format
+from openpyxl.styles.numbers import is_timedelta_format
+from openpyxl.utils import column_index_from_string
+from openpyxl.utils import get_column_letter
+from openpyxl.utils import range_boundaries
+from openpyxl.utils.datetime import CALENDAR_MAC_1904
+from openpyxl.utils.datetime import CALENDAR_WINDOWS_1900
+from openpyxl.utils.datetime import from_excel
+from openpyxl.utils.datetime import from_ISO8601
+from openpyxl.worksheet.cell_range import MultiCellRange
+from openpyxl.worksheet.dimensions import ColumnDimension
+from openpyxl.worksheet.dimensions import RowDimension
+
+try:
+    from openpyxl.worksheet._reader import WorkSheetParser
+except ImportError:
+    # Checked by check_openpyxl
+    WorkSheetParser = None
+
+# Constants
+# openpyxl version the layout copy was written against
+OPENPYXL_VERSION = "3.1"
+SHEET_WORKERS = os.cpu_count() or 1
+# Columns in an Excel worksheet
+MAX_COLUMNS = 16384
+# Files kept free for workbooks, spill files and the interpreter
+RESERVED_FILES = 32
+# C runtime limit on Windows, where the resource module doesn't exist
+WINDOWS_OPEN_FILES = 512
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+DOC_REL_NS = \
+    "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+SHEET_DATA_START_RE = re.compile(rb"<(?:\w+:)?sheetData\b")
+SHEET_DATA_END_RE = re.compile(
+    rb"<(?:\w+:)?sheetData\s*/>|</(?:\w+:)?sheetData>")
+ROW_RE = re.compile(rb"<(?:\w+:)?row\b([^>]*)>")
+ATTRIBUTE_RE = re.compile(rb'([\w:]+)="([^"]*)"')
+EXT_LST_RE = re.compile(rb"<(?:\w+:)?extLst\b")
+# Uncompressed bytes of a worksheet part read at a time
+READ_CHUNK = 2 ** 20
+# Worksheet relationships copy_layout can keep, printer settings are only
+# a cache of the page setup
+KEPT_RELATIONSHIPS = ("hyperlink", "printerSettings")
+# Worksheet settings that are copied as they are
+SHEET_SETTINGS = (
+    "sheet_properties", "views", "sheet_format", "print_options",
+    "page_margins", "page_setup", "HeaderFooter", "scenarios", "protection",
+    "col_breaks")
+
+
+def peak_memory():
+    """
+    Returns the peak resident memory of the current process in MiB, or None
+    where it can't be measured (Windows).
+    """
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KiB elsewhere
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def open_file_limit():
+    """
+    Returns how many files can be kept open at once, such as the text files
+    of each column, from the process's open file limit.
+    """
+
+    try:
+        import resource
+    except ImportError:
+        # Windows
+        return WINDOWS_OPEN_FILES - RESERVED_FILES
+
+    limit, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if limit == resource.RLIM_INFINITY:
+        limit = 2 ** 16
+
+    return max(1, limit - RESERVED_FILES)
+
+
+def iter_worksheets(workbook):
+    """
+    Reads a workbook with openpyxl in read-only mode. Takes in the workbook
+    filename and yields a (worksheet name, rows) tuple for each worksheet,
+    where rows is an iterator of tuples of cell values.
+    """
+
+    wb = openpyxl.load_workbook(workbook, read_only=True)
+
+    try:
+        for worksheet_name in wb.sheetnames:
+            yield worksheet_name, wb[worksheet_name].iter_rows(
+                values_only=True)
+
+    finally:
+        # Read-only workbooks keep the file open until closed
+        wb.close()
+
+
+def read_relationships(xlsx, part):
+    """
+    Reads the relationships of a part of an xlsx package. Takes in the open
+    xlsx ZipFile object and the part name, and returns a dict of
+    relationship IDs to (type, target part name or external URL) tuples.
+    """
+
+    folder, filename = posixpath.split(part)
+    rels_part = posixpath.join(folder, "_rels", filename + ".rels")
+
+    try:
+        rels = ElementTree.fromstring(xlsx.read(rels_part))
+    except KeyError:
+        return {}
+
+    relationships = {}
+    for rel in rels.iter(f"{{{REL_NS}}}Relationship"):
+        target = rel.get("Target")
+        # Targets are relative to the part's folder unless absolute
+        if rel.get("TargetMode") == "External":
+            pass
+        elif target.startswith("/"):
+            target = target[1:]
+        else:
+            target = posixpath.normpath(posixpath.join(folder, target))
+        relationships[rel.get("Id")] = (rel.get("Type"), target)
+
+    return relationships
+
+
+def read_workbook_info(xlsx):
+    """
+    Reads the worksheet list and settings of an xlsx package without
+    loading any worksheet. Takes in the open xlsx ZipFile object and returns
+    a dict with the (worksheet name, part name) tuples of the worksheets in
+    order (sheets), the index of the active worksheet (active), the workbook
+    epoch (epoch) and the shared strings and styles part names, or None
+    (shared_strings and styles).
+    """
+
+    workbook_part = next(
+        target for rel_type, target in read_relationships(xlsx, "").values()
+        if rel_type.endswith("/officeDocument"))
+    relationships = read_relationships(xlsx, workbook_part)
+    parts = {
+        rel_type.rsplit("/", 1)[-1]: target
+        for rel_type, target in relationships.values()
+        }
+
+    wb = ElementTree.fromstring(xlsx.read(workbook_part))
+    workbook_pr = wb.find(f"{{{MAIN_NS}}}workbookPr")
+    if workbook_pr is not None and workbook_pr.get("date1904") in (
+            "1", "true"):
+        epoch = CALENDAR_MAC_1904
+    else:
+        epoch = CALENDAR_WINDOWS_1900
+
+    # First workbook view with an active tab, like openpyxl
+    active = next((
+        int(view.get("activeTab"))
+        for view in wb.iter(f"{{{MAIN_NS}}}workbookView")
+        if view.get("activeTab") is not None
+        ), 0)
+
+    return {
+        "sheets": [
+            (sheet.get("name"),
+             relationships[sheet.get(f"{{{DOC_REL_NS}}}id")][1])
+            for sheet in wb.iter(f"{{{MAIN_NS}}}sheet")
+            ],
+        "active": active,
+        "epoch": epoch,
+        "shared_strings": parts.get("sharedStrings"),
+        "styles": parts.get("styles"),
+        }
+
+
+def worksheet_names(workbook):
+    """
+    Lists the worksheets of a workbook without loading them. Takes in the
+    workbook filename and returns the list of worksheet names and the name
+    of the active worksheet.
+    """
+
+    with zipfile.ZipFile(workbook) as xlsx:
+        info = read_workbook_info(xlsx)
+
+    names = [name for name, _ in info["sheets"]]
+
+    return names, names[info["active"]] if info["active"] < len(
+        names) else None
+
+
+def read_shared_strings(xlsx, part):
+    """
+    Loads the shared strings table of a workbook. Takes in the open xlsx
+    ZipFile object and the shared strings part name (or None), and returns
+    the list of shared strings.
+    """
+
+    strings = []
+
+    if part is None:
+        return strings
+
+    with xlsx.open(part) as source:
+        for _, node in ElementTree.iterparse(source):
+            if node.tag == f"{{{MAIN_NS}}}si":
+                strings.append(text_content(node).replace("x005F_", ""))
+                node.clear()
+
+    return strings
+
+
+def read_date_styles(xlsx, part):
+    """
+    Finds the cell styles whose number format is a date or a duration, as
+    openpyxl does. Takes in the open xlsx ZipFile object and the styles part
+    name (or None), and returns a tuple with the sets of date and timedelta
+    style indexes.
+    """
+
+    date_styles, timedelta_styles = set(), set()
+
+    if part is None:
+        return date_styles, timedelta_styles
+
+    styles = ElementTree.fromstring(xlsx.read(part))
+    custom = {
+        int(num_fmt.get("numFmtId")): num_fmt.get("formatCode")
+        for num_fmt in styles.iter(f"{{{MAIN_NS}}}numFmt")
+        }
+    cell_xfs = styles.find(f"{{{MAIN_NS}}}cellXfs")
+
+    for index, xf in enumerate(
+            [] if cell_xfs is None else cell_xfs.iter(f"{{{MAIN_NS}}}xf")):
+        num_fmt_id = int(xf.get("numFmtId", 0))
+        fmt = custom.get(num_fmt_id) or BUILTIN_FORMATS.get(num_fmt_id)
+        if fmt and is_date_format(fmt):
+            date_styles.add(index)
+        if fmt and is_timedelta_format(fmt):
+            timedelta_styles.add(index)
+
+    return date_styles, timedelta_styles
+
+
+def text_content(node):
+    """
+    Joins the plain and rich text runs of a string item, ignoring phonetic
+    runs. Takes in an si or is Element and returns the text.
+    """
+
+    text = node.findtext(f"{{{MAIN_NS}}}t") or ""
+
+    for run in node.iterfind(f"{{{MAIN_NS}}}r"):
+        text += run.findtext(f"{{{MAIN_NS}}}t") or ""
+
+    return text
+
+
+def iter_worksheets_fast(workbook):
+    """
+    Reads a workbook straight from its xlsx package, without openpyxl's
+    object model. Shared strings and styles are loaded once, then each
+    worksheet is streamed through an incremental XML parser. Cell values
+    match what openpyxl's read-only mode returns. Takes in the workbook
+    filename and yields a (worksheet name, rows) tuple for each worksheet,
+    where rows is an iterator of tuples of cell values.
+    """
+
+    with zipfile.ZipFile(workbook) as xlsx:
+        info = read_workbook_info(xlsx)
+        shared_strings = read_shared_strings(xlsx, info["shared_strings"])
+        date_styles, timedelta_styles = read_date_styles(
+            xlsx, info["styles"])
+
+        for worksheet_name, sheet_part in info["sheets"]:
+            yield worksheet_name, iter_sheet_rows(
+                xlsx, sheet_part, shared_strings, date_styles,
+                timedelta_styles, info["epoch"])
+
+
+def iter_sheet_rows(
+        xlsx, sheet_part, shared_strings, date_styles, timedelta_styles,
+        epoch):
+    """
+    Streams the rows of a worksheet part, yielding each row as soon as it's
+    parsed. Missing rows and cells are filled in with None up to the sheet's
+    dimensions, like openpyxl's read-only mode. Takes in the open xlsx
+    ZipFile object, the worksheet part name, the shared strings list, the
+    sets of date and timedelta style indexes and the workbook epoch, and
+    yields tuples of cell values.
+    """
+
+    max_column = max_row = None
+    empty_row = ()
+    row_counter = 0
+    counter = 1
+    shared_formulae = {}
+
+    with xlsx.open(sheet_part) as source:
+        for event, element in ElementTree.iterparse(
+                source, events=("start", "end")):
+            if event == "start":
+                if element.tag == f"{{{MAIN_NS}}}sheetData":
+                    sheet_data = element
+                continue
+
+            if element.tag == f"{{{MAIN_NS}}}dimension":
+                _, _, max_column, max_row = range_boundaries(
+                    element.get("ref"))
+                empty_row = (None,) * max_column if max_column else ()
+                continue
+
+            if element.tag != f"{{{MAIN_NS}}}row":
+                continue
+
+            row_index = element.get("r")
+            row_counter = int(row_index) if row_index else row_counter + 1
+
+            if max_row is not None and row_counter > max_row:
+                break
+
+            cells = []
+            column_counter = 0
+
+            for cell in element.iterfind(f"{{{MAIN_NS}}}c"):
+                coordinate = cell.get("r")
+                if coordinate:
+                    column_counter = column_index_from_string(
+                        coordinate.rstrip("0123456789"))
+                else:
+                    column_counter += 1
+                    coordinate = \
+                        f"{get_column_letter(column_counter)}{row_counter}"
+
+                cells.append((column_counter, cell_value(
+                    cell, coordinate, shared_strings, date_styles,
+                    timedelta_styles, epoch, shared_formulae)))
+
+            # Free rows already handed out
+            sheet_data.clear()
+
+            # Some rows are missing
+            while counter < row_counter:
+                counter += 1
+                yield empty_row
+
+            if not cells and not max_column:
+                yield ()
+            else:
+                width = max_column or cells[-1][0]
+                row = [None] * width
+                for column, value in cells:
+                    if column <= width:
+                        row[column - 1] = value
+                yield tuple(row)
+
+            counter += 1
+
+
+def cell_value(
+        cell, coordinate, shared_strings, date_styles, timedelta_styles,
+        epoch, shared_formulae):
+    """
+    Converts a worksheet cell element to its value, the same way openpyxl's
+    read-only mode does. Formulas are returned as text starting with "=",
+    and shared formulas are translated from their master cell. Takes in the
+    c Element, the cell coordinate, the shared strings list, the sets of
+    date and timedelta style indexes, the workbook epoch and the dict of
+    shared formulas seen so far, and returns the cell value.
+    """
+
+    data_type = cell.get("t", "n")
+    style_id = int(cell.get("s") or 0)
+    formula = cell.find(f"{{{MAIN_NS}}}f")
+
+    if formula is not None:
+        value = "=" + (formula.text or "")
+
+        if formula.get("t") == "shared":
+            index = formula.get("si")
+            if formula.text:
+                shared_formulae[index] = Translator(value, coordinate)
+            elif index in shared_formulae:
+                value = shared_formulae[index].translate_formula(coordinate)
+
+        return value
+
+    if data_type == "inlineStr":
+        inline = cell.find(f"{{{MAIN_NS}}}is")
+        return None if inline is None else text_content(inline)
+
+    value = cell.findtext(f"{{{MAIN_NS}}}v") or None
+
+    if value is None:
+        return None
+
+    if data_type == "n":
+        if "." in value or "E" in value or "e" in value:
+            value = float(value)
+        else:
+            value = int(value)
+
+        if style_id in date_styles:
+            try:
+                value = from_excel(
+                    value, epoch, timedelta=style_id in timedelta_styles)
+            except (OverflowError, ValueError):
+                value = "#VALUE!"
+
+    elif data_type == "s":
+        value = shared_strings[int(value)]
+    elif data_type == "b":
+        value = bool(int(value))
+    elif data_type == "d":
+        value = from_ISO8601(value)
+
+    return value
+
+
+@contextlib.contextmanager
+def open_workbook(workbook):
+    """
+    Opens a workbook in read-only mode for as long as the with block runs,
+    for reading several of its worksheets and its settings. Takes in the
+    workbook filename and yields the read-only Workbook object.
+    """
+
+    wb = openpyxl.load_workbook(workbook, read_only=True)
+
+    try:
+        yield wb
+    finally:
+        # Read-only workbooks keep the file open until closed
+        wb.close()
+
+
+def read_worksheet(
+        workbook, worksheet_name=None, fast=False, values_only=True):
+    """
+    Streams the rows of a single worksheet, starting from cell A1. Takes in
+    the workbook filename or a workbook opened by open_workbook, the
+    worksheet name (the active worksheet if None), whether to use the
+    native xlsx reader (fast, filenames only) and whether to yield cell
+    values or openpyxl's read-only cells (values_only, the native reader
+    only yields values), and yields tuples of cell values or cells.
+    """
+
+    if isinstance(workbook, openpyxl.Workbook):
+        sheet = workbook.active if worksheet_name is None \
+            else workbook[worksheet_name]
+        yield from sheet.iter_rows(
+            min_row=1, min_col=1, values_only=values_only)
+        return
+
+    if fast and values_only:
+        if worksheet_name is None:
+            _, worksheet_name = worksheet_names(workbook)
+
+        for name, rows in iter_worksheets_fast(workbook):
+            if name == worksheet_name:
+                yield from rows
+                return
+
+        raise KeyError(f"Worksheet {worksheet_name} does not exist.")
+
+    with open_workbook(workbook) as wb:
+        yield from read_worksheet(wb, worksheet_name, values_only=values_only)
+
+
+def map_worksheets(
+        function, workbook, worksheets, *args, workers=SHEET_WORKERS):
+    """
+    Runs a function on several worksheets of a workbook at a time, each in
+    a worker process that reads the workbook on its own. Takes in the
+    function, which is called as function(workbook, worksheet name, *args),
+    the workbook filename, the list of worksheet names, any further
+    arguments for the function and the number of worker processes (workers,
+    keyword only), and yields the function's results in worksheet order.
+    """
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(function, workbook, worksheet_name, *args)
+            for worksheet_name in worksheets
+            ]
+
+        for future in futures:
+            yield future.result()
+
+
+def append_rows(sheet, rows):
+    """
+    Writes rows to a write-only worksheet as they come. Takes in the
+    write-only worksheet and an iterable of rows, and returns the number
+    of rows written.
+    """
+
+    count = 0
+
+    for row in rows:
+        sheet.append(row)
+        count += 1
+
+    return count
+
+
+def copy_style(cell, sheet, value, styles):
+    """
+    Gives a value the style of a read-only cell, for writing to a
+    write-only worksheet. Each distinct style is copied into the new
+    workbook once and then shared. Takes in the read-only cell, the
+    write-only worksheet, the value and the dict of styles already copied,
+    and returns the value itself if the cell has no style, or a styled
+    WriteOnlyCell.
+    """
+
+    if cell is EMPTY_CELL or not cell.has_style:
+        return value
+
+    style_key = tuple(cell.style_array)
+
+    if style_key not in styles:
+        style_cell = WriteOnlyCell(sheet)
+        style_cell.font = cell.font
+        style_cell.fill = cell.fill
+        style_cell.border = cell.border
+        style_cell.number_format = cell.number_format
+        style_cell.alignment = cell.alignment
+        style_cell.protection = cell.protection
+        styles[style_key] = style_cell._style
+
+    new_cell = WriteOnlyCell(sheet, value)
+    # Same as openpyxl does when copying worksheets
+    new_cell._style = copy(styles[style_key])
+
+    return new_cell
+
+
+def named_style_cell(sheet, value, style_name, styles):
+    """
+    Makes a cell with a named style for a write-only worksheet. The named
+    style is looked up once and then shared. Takes in the write-only
+    worksheet, the value, the name of a style added to the workbook and
+    the dict of styles already looked up, and returns the WriteOnlyCell.
+    """
+
+    if style_name not in styles:
+        style_cell = WriteOnlyCell(sheet)
+        style_cell.style = style_name
+        styles[style_name] = style_cell._style
+
+    new_cell = WriteOnlyCell(sheet, value)
+    new_cell._style = copy(styles[style_name])
+
+    return new_cell
+
+
+def read_layout(archive, sheet_part):
+    """
+    Reads everything in a worksheet part but its cells: column widths,
+    merged ranges, views, conditional formatting, data validation,
+    hyperlinks, page setup and the like, which read-only worksheets don't
+    load, and the settings of each row, such as its height. The part is
+    streamed, only the XML around the rows and the row tags are kept.
+    Takes in the open xlsx ZipFile object and the worksheet part name, and
+    returns a dict with openpyxl's parser holding the worksheet settings
+    (settings), a dict of row numbers to row attributes (rows), the
+    worksheet's relationships (relationships) and a list of the parts of the
+    worksheet that can't be copied (lost).
+    """
+
+    head = None
+    tail = b""
+    pending = b""
+    found = False
+    rows = {}
+    row_number = 0
+
+    with archive.open(sheet_part) as source:
+        while True:
+            chunk = source.read(READ_CHUNK)
+            if not chunk:
+                break
+
+            if found:
+                tail += chunk
+                continue
+
+            if head is None:
+                match = SHEET_DATA_START_RE.search(chunk)
+                head = chunk[:match.start()] if match else chunk
+
+            # Keep any tag split by the end of the previous chunk
+            data = pending + chunk
+            match = SHEET_DATA_END_RE.search(data)
+            if match:
+                scanned, tail = data[:match.start()], data[match.end():]
+                found = True
+            else:
+                cut = data.rfind(b">") + 1
+                scanned, pending = data[:cut], data[cut:]
+
+            for tag in ROW_RE.findall(scanned):
+                attributes = {
+                    key.decode(): value.decode()
+                    for key, value in ATTRIBUTE_RE.findall(tag)
+                    }
+                row_number = int(attributes.get("r", row_number + 1))
+                # Namespaced attributes are dropped, as openpyxl does
+                attributes = {
+                    key: value for key, value in attributes.items()
+                    if ":" not in key and key not in ("r", "spans")
+                    }
+                if attributes:
+                    rows[row_number] = attributes
+
+    settings = WorkSheetParser(io.BytesIO((head or b"") + tail), [])
+    for _ in settings.parse():
+        pass
+
+    relationships = read_relationships(archive, sheet_part)
+    lost = sorted({
+        rel_type.rsplit("/", 1)[-1] for rel_type, _ in relationships.values()
+        if rel_type.rsplit("/", 1)[-1] not in KEPT_RELATIONSHIPS
+        })
+    if EXT_LST_RE.search(head or b"") or EXT_LST_RE.search(tail):
+        lost.append("extensions")
+
+    return {
+        "settings": settings,
+        "rows": rows,
+        "relationships": relationships,
+        "lost": lost,
+        }
+
+
+def check_openpyxl():
+    """
+    Checks that openpyxl still has the internals read_layout, copy_layout
+    and copy_style rely on: the worksheet XML parser, workbook differential
+    styles, print titles and areas, cell style arrays, and the write-only
+    worksheet's writer and hyperlinks. Raises ValueError naming those that
+    are missing.
+    """
+
+    wb = openpyxl.Workbook()
+    write_only_wb = openpyxl.Workbook(write_only=True)
+    new_sheet = write_only_wb.create_sheet()
+    internals = (
+        (wb, "_differential_styles"),
+        (wb.active, "_print_rows"),
+        (wb.active, "_print_cols"),
+        (wb.active, "_print_area"),
+        (WriteOnlyCell(new_sheet), "_style"),
+        (new_sheet, "_get_writer"),
+        (new_sheet, "_hyperlinks"),
+        )
+
+    missing = [
+        f"{type(owner).__name__}.{name}" for owner, name in internals
+        if not hasattr(owner, name)
+        ]
+    if WorkSheetParser is None:
+        missing.append("openpyxl.worksheet._reader.WorkSheetParser")
+
+    if missing:
+        raise ValueError(
+            f"openpyxl {openpyxl.__version__} doesn't have "
+            f"{', '.join(missing)}, which copying sheet layouts needs; "
+            f"install openpyxl {OPENPYXL_VERSION}")
+
+
+def read_layouts(workbook, worksheets):
+    """
+    Reads the layout of several worksheets with read_layout, checking first
+    that openpyxl can copy them and that none of them has parts that would
+    be lost by copying it into a write-only workbook. Takes in the workbook
+    filename and the list of worksheet names, and returns a dict of
+    worksheet names to layouts. Raises ValueError if the layouts can't be
+    copied.
+    """
+
+    check_openpyxl()
+
+    with zipfile.ZipFile(workbook) as archive:
+        sheet_parts = dict(read_workbook_info(archive)["sheets"])
+        layouts = {
+            worksheet_name: read_layout(archive, sheet_parts[worksheet_name])
+            for worksheet_name in worksheets
+            }
+
+    lost = [
+        f"{worksheet_name} ({', '.join(layout['lost'])})"
+        for worksheet_name, layout in layouts.items() if layout["lost"]
+        ]
+    if lost:
+        raise ValueError(
+            "these sheets have parts that can't be kept, such as charts, "
+            f"comments or tables: {'; '.join(lost)}")
+
+    return layouts
+
+
+def copy_cell_style(sheet, style_id, new_sheet, styles):
+    """
+    Copies a cell style of a read-only worksheet's workbook into a
+    write-only worksheet's workbook, for row and column styles. Takes in
+    the read-only worksheet, the style index, the write-only worksheet and
+    the dict of styles already copied, and returns the new style array, or
+    None for the default style.
+    """
+
+    cell = copy_style(
+        ReadOnlyCell(sheet, 1, 1, None, style_id=style_id), new_sheet, None,
+        styles)
+
+    return None if cell is None else copy(cell._style)
+
+
+def copy_layout(
+        sheet, new_sheet, layout, styles, shift_row=None, shift_formula=None):
+    """
+    Copies the layout read by read_layout into a write-only worksheet. It
+    has to be copied before any row is written. Row numbers and references
+    can be moved along the way, for rows inserted into the sheet. Takes in
+    the read-only worksheet, the write-only worksheet, the layout dict, the
+    dict of styles already copied, and optionally the function that moves
+    a row number of this sheet (shift_row) and the function that moves the
+    references of a formula starting with "=" (shift_formula).
+    """
+
+    settings = layout["settings"]
+
+    def shift_reference(reference):
+        if shift_formula is None or not reference:
+            return reference
+        return shift_formula(f"={reference}")[1:]
+
+    def shift_ranges(ranges):
+        return " ".join(
+            shift_reference(reference) for reference in str(ranges).split())
+
+    new_sheet.sheet_state = sheet.sheet_state
+    for name in SHEET_SETTINGS:
+        value = getattr(settings, name, None)
+        if value is not None:
+            setattr(new_sheet, name, value)
+
+    for letter, attributes in settings.column_dimensions.items():
+        attributes = {
+            key: value for key, value in attributes.items()
+            if not key.startswith("{")
+            }
+        style_id = attributes.pop("style", None)
+        new_sheet.column_dimensions[letter] = ColumnDimension(
+            new_sheet, style=None if style_id is None else copy_cell_style(
+                sheet, int(style_id), new_sheet, styles), **attributes)
+
+    for row_number, attributes in layout["rows"].items():
+        attributes = dict(attributes)
+        style_id = attributes.pop("s", None)
+        new_row = shift_row(row_number) if shift_row else row_number
+        new_sheet.row_dimensions[new_row] = RowDimension(
+            new_sheet, index=new_row, s=None if style_id is None else
+            copy_cell_style(sheet, int(style_id), new_sheet, styles),
+            **attributes)
+
+    if settings.merged_cells:
+        for merged_cell in settings.merged_cells.mergeCell:
+            new_sheet.merged_cells.add(shift_reference(merged_cell.ref))
+
+    for formatting in settings.formatting:
+        for rule in formatting.rules:
+            # Differential styles are numbered per workbook
+            if rule.dxfId is not None:
+                rule.dxf = sheet.parent._differential_styles[rule.dxfId]
+                rule.dxfId = None
+            rule.formula = [
+                shift_reference(formula) for formula in rule.formula]
+            new_sheet.conditional_formatting.add(
+                shift_ranges(formatting.sqref), rule)
+
+    validations = getattr(settings, "data_validations", None)
+    if validations is not None:
+        for validation in validations.dataValidation:
+            validation.sqref = MultiCellRange(
+                shift_ranges(validation.sqref))
+            validation.formula1 = shift_reference(validation.formula1)
+            validation.formula2 = shift_reference(validation.formula2)
+        new_sheet.data_validations = validations
+
+    auto_filter = getattr(settings, "auto_filter", None)
+    if auto_filter is not None:
+        auto_filter.ref = shift_reference(auto_filter.ref)
+        new_sheet.auto_filter = auto_filter
+
+    for page_break in settings.row_breaks.brk:
+        if shift_row:
+            page_break.id = shift_row(page_break.id)
+    new_sheet.row_breaks = settings.row_breaks
+
+    for name, defined_name in sheet.defined_names.items():
+        defined_name = copy(defined_name)
+        defined_name.attr_text = shift_reference(defined_name.attr_text)
+        new_sheet.defined_names[name] = defined_name
+
+    # Set up by openpyxl from the workbook's reserved names
+    if getattr(sheet, "_print_rows", None):
+        new_sheet.print_title_rows = shift_reference(str(sheet._print_rows))
+    if getattr(sheet, "_print_cols", None):
+        new_sheet.print_title_cols = str(sheet._print_cols)
+    if getattr(sheet, "_print_area", None):
+        new_sheet.print_area = shift_ranges(
+            str(sheet._print_area).replace(",", " ")).split()
+
+    # The worksheet writer starts with no hyperlinks, so it is set up first.
+    # It writes everything that goes before the rows, which is all set.
+    new_sheet._get_writer()
+    for hyperlink in settings.hyperlinks.hyperlink:
+        if hyperlink.id:
+            hyperlink.target = layout["relationships"][hyperlink.id][1]
+            hyperlink.id = None
+        hyperlink.ref = shift_reference(hyperlink.ref)
+        hyperlink.location = shift_reference(hyperlink.location)
+        new_sheet._hyperlinks.append(hyperlink)
+
+
+def copy_workbook_settings(wb, new_wb, shift_formula=None):
+    """
+    Copies the defined names, document properties and calculation settings
+    of a read-only workbook into a write-only one. Takes in both Workbook
+    objects and optionally the function that moves the references of a
+    formula starting with "=" (shift_formula).
+    """
+
+    for name, defined_name in wb.defined_names.items():
+        defined_name = copy(defined_name)
+        if shift_formula is not None and defined_name.attr_text:
+            defined_name.attr_text = shift_formula(
+                f"={defined_name.attr_text}")[1:]
+        new_wb.defined_names[name] = defined_name
+
+    new_wb.properties = wb.properties
+    new_wb.calculation = wb.calculation
+
+
+def file_hash(filename):
+    """
+    Hashes the contents of a file. Takes in a string with the file path and
+    returns the hex SHA-256 digest of its contents.
+    """
+
+    digest = hashlib.sha256()
+
+    with open(filename, "rb") as hashed_file:
+        for block in iter(lambda: hashed_file.read(2 ** 20), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def save_workbook(wb, workbook):
+    """
+    Saves a workbook, replacing the file only once the new one is complete,
+    so that a workbook being rewritten can still be read while saving.
+    Takes in the Workbook object and the workbook filename.
+    """
+
+    new_file, new_workbook = tempfile.mkstemp(
+        ".xlsx", dir=os.path.dirname(os.path.abspath(workbook)))
+    os.close(new_file)
+
+    try:
+        wb.save(new_workbook)
+        os.replace(new_workbook, workbook)
+    except BaseException:
+        os.remove(new_workbook)
+        raise
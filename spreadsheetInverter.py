@@ -18,45 +18,415 @@
 # 
 # Nadia Borsch      misc@nborsch.com        Jun/2018
 
-import openpyxl, os
+import array
+import functools
+import mmap
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 
-print(f"\n{'Spreadsheet Cell Inverter':>35}")
-print(f"{'=========== ==== ========':>35}")
+import numpy as np
+import openpyxl
 
-print(f"\nCurrent working directory is {os.getcwd()}.")
+from spreadsheetIO import MAX_COLUMNS
+from spreadsheetIO import append_rows
+from spreadsheetIO import copy_layout
+from spreadsheetIO import copy_style
+from spreadsheetIO import copy_workbook_settings
+from spreadsheetIO import open_workbook
+from spreadsheetIO import peak_memory
+from spreadsheetIO import read_layouts
+from spreadsheetIO import read_worksheet
+from spreadsheetIO import save_workbook
 
-while True:
-    workbook = input("Please enter the name of the spreadsheet file to invert:\n")
-    if workbook.endswith(".xlsx"):
-        break
+# Constants
+# Cells read before a block of rows is spilled to disk by the streaming
+# transpose, which bounds its memory use
+SPILL_BLOCK_CELLS = 2 ** 20
+# Rows the NumPy transpose makes room for at first, doubled when full
+NUMPY_BLOCK_ROWS = 1024
+BENCHMARK_SHAPES = ((100, 100), (1000, 1000), (5000, 200))
+BENCHMARK_FILE = "benchmark.xlsx"
 
-# Set up workbook and worksheets
-wb = openpyxl.load_workbook(workbook)
-sheet = wb.active
-new_sheet = wb.create_sheet(f"NEW {sheet.title}", 0)
 
-# List of lists to store cell data
-sheet_data = [[] for i in range(sheet.max_row)]
+def invert_sheet(workbook):
+    """
+    Inverts the active sheet of a workbook in memory, cell by cell, and
+    saves it over the workbook. The inverted sheet becomes the first sheet
+    and every other sheet is kept as is. Takes in the workbook filename.
+    """
 
-# Populating data structure with sheet data
-for row in range(1, sheet.max_row + 1):
-    for cell in range(1, sheet.max_column + 1):
-        sheet_data[row - 1].append(sheet.cell(row=row, column=cell).value)
+    # Set up workbook and worksheets
+    wb = openpyxl.load_workbook(workbook)
+    sheet = wb.active
+    new_sheet = wb.create_sheet(f"NEW {sheet.title}", 0)
+
+    # List of lists to store cell data
+    sheet_data = [[] for i in range(sheet.max_row)]
 
-# Inverting data and saving to new sheet
-for cell in range(1, sheet.max_column + 1):
+    # Populating data structure with sheet data
     for row in range(1, sheet.max_row + 1):
-        new_sheet.cell(row=cell, column=row).value = sheet_data[row - 1][cell - 1]
+        for cell in range(1, sheet.max_column + 1):
+            sheet_data[row - 1].append(
+                sheet.cell(row=row, column=cell).value)
+
+    # Inverting data and saving to new sheet
+    for cell in range(1, sheet.max_column + 1):
+        for row in range(1, sheet.max_row + 1):
+            new_sheet.cell(row=cell, column=row).value = \
+                sheet_data[row - 1][cell - 1]
+
+    # Remove old sheet and rename new sheet
+    wb.remove(sheet)
+    new_sheet.title = sheet.title
+
+    print("Saving...")
+    wb.save(workbook)
+
+
+def spill_block(block, spill_file):
+    """
+    Writes a block of rows to a spill file column by column, so that any
+    column of the block can be read back on its own. Takes in a list of row
+    tuples and an open binary file, and returns a tuple with the number of
+    rows in the block and an array of the file offsets where each column
+    starts, followed by the offset where the block ends.
+    """
+
+    width = max(len(row) for row in block)
+    offsets = array.array("q")
+
+    for column in range(width):
+        offsets.append(spill_file.tell())
+        spill_file.write(pickle.dumps(
+            [row[column] if column < len(row) else None for row in block],
+            pickle.HIGHEST_PROTOCOL))
+
+    offsets.append(spill_file.tell())
+
+    return len(block), offsets
+
+
+def spill_rows(rows, spill_file, block_cells=SPILL_BLOCK_CELLS):
+    """
+    Splits a sheet into blocks of about block_cells cells and spills each
+    block to a file by column, holding a single block in memory at a time.
+    Takes in an iterator of row tuples, an open binary file and the number
+    of cells per block, and returns the list of blocks written, as returned
+    by spill_block.
+    """
+
+    blocks = []
+    block = []
+    cells = 0
+
+    for row in rows:
+        block.append(row)
+        cells += len(row) or 1
+
+        if cells >= block_cells:
+            blocks.append(spill_block(block, spill_file))
+            block = []
+            cells = 0
+
+    if block:
+        blocks.append(spill_block(block, spill_file))
+
+    return blocks
+
+
+def iter_transposed(blocks, spill_file):
+    """
+    Reads the spilled blocks of a sheet back column by column through a
+    memory map of the spill file. Takes in the list of blocks returned by
+    spill_rows and the spill file, and yields each column of the sheet as a
+    list of values, that is, each row of the inverted sheet.
+    """
+
+    width = max((len(offsets) - 1 for _, offsets in blocks), default=0)
+
+    if not width:
+        return
+
+    spill_file.flush()
+    with mmap.mmap(
+            spill_file.fileno(), 0, access=mmap.ACCESS_READ) as spill_map:
+        for column in range(width):
+            new_row = []
+
+            for count, offsets in blocks:
+                if column < len(offsets) - 1:
+                    new_row.extend(pickle.loads(
+                        spill_map[offsets[column]:offsets[column + 1]]))
+                else:
+                    # Block is narrower than the sheet
+                    new_row.extend([None] * count)
+
+            yield new_row
+
+
+def transpose_spilled(rows, block_cells=SPILL_BLOCK_CELLS):
+    """
+    Inverts a sheet out of core: its rows are spilled to a temporary file
+    in blocks and the inverted rows are read back from it, so memory use is
+    bounded by the block size rather than the sheet size. Takes in an
+    iterator of row tuples and the number of cells per spilled block, and
+    yields the rows of the inverted sheet as lists.
+    """
+
+    with tempfile.TemporaryFile() as spill_file:
+        blocks = spill_rows(rows, spill_file, block_cells)
+        check_rows(sum(count for count, _ in blocks))
+
+        yield from iter_transposed(blocks, spill_file)
+
+
+def row_dtype(row):
+    """
+    Picks the array type for a row of values: int or float when every
+    value has that type, object otherwise. Takes in a row tuple and returns
+    the NumPy dtype.
+    """
+
+    value_types = {type(value) for value in row}
+
+    if len(value_types) == 1 and value_types < {int, float}:
+        return np.dtype(value_types.pop())
+
+    return np.dtype(object)
+
+
+def resize_values(values, count, length, width, dtype):
+    """
+    Moves the rows filled so far into a new array, for when more rows or
+    columns are needed or the values no longer fit the array's type. Cells
+    of an object array that are never filled hold None. Takes in the array,
+    the number of rows filled, the new number of rows and columns and the
+    new dtype, and returns the new array.
+    """
+
+    new_values = np.empty((length, width), dtype=dtype)
+    new_values[:count, :values.shape[1]] = values[:count]
+
+    return new_values
+
+
+def transpose_numpy(rows):
+    """
+    Inverts a sheet in memory with NumPy. The rows are streamed straight
+    into an array that doubles in length as it fills: a typed array while
+    every cell holds an int, or every cell a float, and rows are all the
+    same width, and an object array otherwise. The array is then inverted
+    through its transposed view without copying. Takes in an iterator of
+    row tuples and yields the rows of the inverted sheet as lists.
+    """
+
+    values = None
+    count = 0
+
+    for row in rows:
+        if values is None:
+            values = np.empty(
+                (NUMPY_BLOCK_ROWS, len(row)), dtype=row_dtype(row))
 
-# Remove old sheet and rename new sheet
-wb.remove(sheet)
-new_sheet.title = sheet.title
+        length, width = values.shape
+        if count == length or len(row) > width:
+            values = resize_values(
+                values, count, length * 2 if count == length else length,
+                max(len(row), width), values.dtype)
+
+        if values.dtype != object and (
+                len(row) != values.shape[1] or row_dtype(row) != values.dtype):
+            values = resize_values(
+                values, count, len(values), values.shape[1], object)
+
+        try:
+            values[count, :len(row)] = row
+        except OverflowError:
+            # Integers that don't fit 64 bits
+            values = resize_values(
+                values, count, len(values), values.shape[1], object)
+            values[count, :len(row)] = row
+
+        count += 1
+        check_rows(count)
+
+    if values is None or not values.shape[1]:
+        return
+
+    for new_row in values[:count].T:
+        yield new_row.tolist()
+
+
+def check_rows(count):
+    """
+    Checks that the inverted sheet fits in a spreadsheet, since the rows of
+    the old sheet become columns of the new one. Takes in the number of rows
+    of the sheet and raises ValueError if there are too many.
+    """
+
+    if count > MAX_COLUMNS:
+        raise ValueError(
+            f"sheet has more than {MAX_COLUMNS} rows, its inverted sheet "
+            "wouldn't fit in a spreadsheet")
+
+
+def invert_workbook(workbook, transpose):
+    """
+    Inverts the active sheet of a workbook, streaming its rows from the
+    xlsx package into a write-only workbook, and saves it over the
+    workbook. The inverted sheet becomes the first sheet, as with
+    invert_sheet, and every other sheet is copied after it with its cell
+    styles and layout. The workbook is left untouched if those sheets have
+    parts that can't be copied, such as charts or comments. Takes in the
+    workbook filename and the function that inverts the sheet's rows
+    (transpose_spilled or transpose_numpy).
+    """
+
+    new_wb = openpyxl.Workbook(write_only=True)
+    styles = {}
+
+    with open_workbook(workbook) as wb:
+        active_name = wb.active.title
+        sheet_names = [
+            sheet_name for sheet_name in wb.sheetnames
+            if sheet_name != active_name]
+
+        layouts = read_layouts(workbook, sheet_names)
+        copy_workbook_settings(wb, new_wb)
+
+        new_sheet = new_wb.create_sheet(active_name)
+        append_rows(new_sheet, transpose(
+            read_worksheet(workbook, active_name, fast=True)))
+
+        # Copy every other sheet after the inverted one
+        for sheet_name in sheet_names:
+            copy_sheet(
+                wb[sheet_name], new_wb.create_sheet(sheet_name),
+                layouts.pop(sheet_name), styles)
 
-# Save workbook
-try:
     print("Saving...")
-    wb.save(f"{workbook}")
-    print("Done.")
+    save_workbook(new_wb, workbook)
+
+
+def copy_sheet(sheet, new_sheet, layout, styles):
+    """
+    Copies a read-only worksheet into a write-only one as it is, with its
+    cell styles and layout. Takes in the read-only worksheet, the
+    write-only worksheet, the sheet's layout read by read_layouts and the
+    dict of styles already copied.
+    """
+
+    copy_layout(sheet, new_sheet, layout, styles)
+
+    for row in read_worksheet(sheet.parent, sheet.title, values_only=False):
+        new_sheet.append([
+            copy_style(cell, new_sheet, cell.value, styles) for cell in row])
+
+
+def invert_streaming(workbook, block_cells=SPILL_BLOCK_CELLS):
+    """
+    Inverts the active sheet of a workbook without loading it in memory,
+    and saves it over the workbook. Takes in the workbook filename and the
+    number of cells per spilled block.
+    """
+
+    invert_workbook(workbook, functools.partial(
+        transpose_spilled, block_cells=block_cells))
+
+
+def invert_numpy(workbook):
+    """
+    Inverts the active sheet of a workbook in memory with NumPy, and saves
+    it over the workbook. Faster than invert_streaming for sheets that fit
+    in memory. Takes in the workbook filename.
+    """
+
+    invert_workbook(workbook, transpose_numpy)
+
+
+def benchmark_run(inverter, workbook):
+    """
+    Runs one benchmark case. Takes in the name of the inverter function and
+    the workbook filename, and returns the time taken in seconds and the
+    peak resident memory in MiB (None where it can't be measured).
+    """
+
+    start_time = time.perf_counter()
+    globals()[inverter](workbook)
+
+    return time.perf_counter() - start_time, peak_memory()
+
+
+def benchmark_inverters(shapes=BENCHMARK_SHAPES):
+    """
+    Compares the cell loop, NumPy and streaming inverters on generated
+    sheets of mixed numbers and text, each run in a fresh process so peak
+    memory isn't carried over between runs. Takes in a list of (rows,
+    columns) sheet shapes.
+    """
+
+    for rows, columns in shapes:
+        wb = openpyxl.Workbook(write_only=True)
+        sheet = wb.create_sheet("Data")
+        for row in range(rows):
+            sheet.append([
+                f"R{row}C{column}" if column % 4 == 0 else
+                row * columns + column for column in range(columns)
+                ])
+        wb.save(BENCHMARK_FILE)
+
+        for inverter in ("invert_sheet", "invert_numpy", "invert_streaming"):
+            shutil.copyfile(BENCHMARK_FILE, f"benchmark_{inverter}.xlsx")
+
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                elapsed, peak = executor.submit(
+                    benchmark_run, inverter,
+                    f"benchmark_{inverter}.xlsx").result()
+
+            os.remove(f"benchmark_{inverter}.xlsx")
+            peak = "n/a" if peak is None else f"{peak:.0f} MiB"
+            print(
+                f"{rows:>5} x {columns:<5} {inverter:<17}: {elapsed:8.2f}s, "
+                f"peak memory {peak}")
+
+        os.remove(BENCHMARK_FILE)
+
+
+def main(numpy=False):
+    print(f"\n{'Spreadsheet Cell Inverter':>35}")
+    print(f"{'=========== ==== ========':>35}")
+
+    print(f"\nCurrent working directory is {os.getcwd()}.")
+
+    while True:
+        workbook = input("Please enter the name of the spreadsheet file to invert:\n")
+        if workbook.endswith(".xlsx"):
+            break
+
+    # Save workbook
+    try:
+        if numpy:
+            invert_numpy(workbook)
+        else:
+            invert_streaming(workbook)
+        print("Done.")
+
+    except PermissionError:
+        print("\nCOULD NOT SAVE FILE, PLEASE TRY AGAIN.")
+
+    except ValueError as error:
+        print(f"\nCOULD NOT INVERT SPREADSHEET: {error}")
+
 
-except PermissionError:
-    print("\nCOULD NOT SAVE FILE, PLEASE TRY AGAIN.")
\ No newline at end of file
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "--benchmark":
+        # spreadsheetInverter.py --benchmark
+        benchmark_inverters()
+    else:
+        # spreadsheetInverter.py [--numpy]
+        main(numpy=len(sys.argv) > 1 and sys.argv[1] == "--numpy")
@@ -0,0 +1,93 @@
+#! python3
+# -*- coding: utf-8 -*-
+#
+# Checks that blankRowInserter moves the row numbers of references to the
+# edited sheet, and only those.
+
+import openpyxl
+import pytest
+
+from blankRowInserter import insert_rows
+from blankRowInserter import reference_rows
+from blankRowInserter import shift_formula
+
+
+def shift_row(row):
+    # Three blank rows inserted after row 2
+    return row + 3 if row > 2 else row
+
+
+@pytest.mark.parametrize("reference, is_edited, expected", [
+    ("A5", True, [2]),
+    ("A5", False, []),
+    ("$B$12:C20", True, [5, 9]),
+    ("3:5", True, [1, 3]),
+    ("A:C", True, []),
+    ("Sheet1!A5", False, [9]),
+    ("Sheet2!A5", True, []),
+    ("'Sheet1'!A5", False, [11]),
+    ("'My ''Data'''!A5", False, []),
+    ])
+def test_reference_rows(reference, is_edited, expected):
+    assert reference_rows(reference, is_edited, "Sheet1") == expected
+
+
+@pytest.mark.parametrize("formula, is_edited, expected", [
+    ("=A1+A5", True, "=A1+A8"),
+    ("=$A$5*B$2+C$3", True, "=$A$8*B$2+C$6"),
+    ("=SUM(3:5)", True, "=SUM(6:8)"),
+    ("=SUM(A1:A10)", True, "=SUM(A1:A13)"),
+    ("=A5", False, "=A5"),
+    ("=Sheet1!A5+A5", False, "=Sheet1!A8+A5"),
+    ("=Sheet2!A5", False, "=Sheet2!A5"),
+    ("=Sheet2!A5", True, "=Sheet2!A5"),
+    ("='Sheet1'!$B$4", False, "='Sheet1'!$B$7"),
+    ('="A5"&A5', True, '="A5"&A8'),
+    ("=Total*2", True, "=Total*2"),
+    ])
+def test_shift_formula(formula, is_edited, expected):
+    assert shift_formula(formula, is_edited, "Sheet1", shift_row, {}) == \
+        expected
+
+
+def test_shift_formula_cache():
+    templates = {}
+
+    assert shift_formula(
+        "=A4*2", True, "Sheet1", shift_row, templates) == "=A7*2"
+    assert shift_formula(
+        "=A5*2", True, "Sheet1", shift_row, templates) == "=A8*2"
+    assert len(templates) == 1
+
+    # Sheet names that only differ by a digit need templates of their own
+    assert shift_formula(
+        "=Sheet2!A5", False, "Sheet1", shift_row, templates) == "=Sheet2!A5"
+    assert shift_formula(
+        "=Sheet1!A5", False, "Sheet1", shift_row, templates) == "=Sheet1!A8"
+    assert shift_formula(
+        "=Sheet2!A6", False, "Sheet1", shift_row, templates) == "=Sheet2!A6"
+
+
+def test_insert_rows(tmp_path):
+    wb = openpyxl.Workbook()
+    sheet = wb.active
+    sheet.title = "Sheet1"
+    for row in range(1, 6):
+        sheet.append([row, f"=A{row}*2"])
+    wb.create_sheet("Sheet2")["A5"] = "other"
+    references = wb.create_sheet("Sheet3")
+    references["A1"] = "=Sheet1!A5"
+    references["A2"] = "=Sheet2!A5"
+    references["A3"] = "=Sheet1!A5"
+    workbook = tmp_path / "a.xlsx"
+    wb.save(workbook)
+
+    insert_rows(workbook, [(2, 3)])
+
+    wb = openpyxl.load_workbook(workbook)
+    sheet = wb["Sheet1"]
+    assert [row[0] for row in sheet.iter_rows(values_only=True)] == [
+        1, 2, None, None, None, 3, 4, 5]
+    assert sheet["B8"].value == "=A8*2"
+    assert [cell.value for cell in wb["Sheet3"]["A"]] == [
+        "=Sheet1!A8", "=Sheet2!A5", "=Sheet1!A8"]
@@ -0,0 +1,154 @@
+#! python3
+# -*- coding: utf-8 -*-
+#
+# Checks that excel2csv's native xlsx reader returns the same worksheets
+# and cell values as openpyxl's read-only mode.
+
+import datetime
+import re
+import zipfile
+
+import openpyxl
+import pytest
+
+from excel2csv import check_fast_path
+from spreadsheetIO import iter_worksheets
+from spreadsheetIO import iter_worksheets_fast
+
+# Rows openpyxl never writes: inline strings, rich inline strings, empty
+# inline strings and a shared formula filled down from its master cell
+PATCHED_ROWS = (
+    '<row r="1">'
+    '<c r="A1" t="inlineStr"><is><t>inline</t></is></c>'
+    '<c r="B1"><f t="shared" ref="B1:B3" si="0">C1*2</f><v>2</v></c>'
+    '<c r="C1"><v>1</v></c>'
+    '</row>'
+    '<row r="2">'
+    '<c r="A2" t="inlineStr"><is><r><t>rich </t></r><r><t>text</t></r>'
+    '</is></c>'
+    '<c r="B2"><f t="shared" si="0"/><v>4</v></c>'
+    '<c r="C2"><v>2</v></c>'
+    '</row>'
+    '<row r="4">'
+    '<c r="A4" t="inlineStr"/>'
+    '<c r="B4"><f>SUM(C1:C2)</f><v>3</v></c>'
+    '</row>'
+    )
+
+
+def read_both(workbook):
+    """
+    Reads a workbook with both readers. Takes in the workbook filename and
+    returns a tuple with the lists of (worksheet name, list of rows) tuples
+    read by openpyxl and by the native reader.
+    """
+
+    return tuple(
+        [(name, list(rows)) for name, rows in worksheets(workbook)]
+        for worksheets in (iter_worksheets, iter_worksheets_fast))
+
+
+def patch_sheet(workbook, sheet_xml, dimension, rows):
+    """
+    Replaces the rows of a worksheet part with hand-written XML. Takes in
+    the workbook filename, the worksheet part name, the new dimension
+    reference and the XML of the new rows.
+    """
+
+    with zipfile.ZipFile(workbook) as xlsx:
+        parts = {name: xlsx.read(name) for name in xlsx.namelist()}
+
+    sheet = parts[sheet_xml].decode("utf-8")
+    sheet = re.sub(
+        r'<dimension ref="[^"]*"/>', f'<dimension ref="{dimension}"/>',
+        sheet)
+    sheet = re.sub(
+        r"<sheetData>.*</sheetData>|<sheetData/>",
+        lambda match: f"<sheetData>{rows}</sheetData>", sheet)
+    parts[sheet_xml] = sheet.encode("utf-8")
+
+    with zipfile.ZipFile(workbook, "w", zipfile.ZIP_DEFLATED) as xlsx:
+        for name, data in parts.items():
+            xlsx.writestr(name, data)
+
+
+@pytest.fixture
+def mixed_workbook(tmp_path):
+    wb = openpyxl.Workbook()
+    sheet = wb.active
+    sheet.title = "Data"
+    sheet.append(["Name", "Count", "Price", "Paid", "Date", "Time"])
+    for number in range(1, 21):
+        sheet.append([
+            f"Item {number}", number, number * 0.25, number % 2 == 0,
+            datetime.datetime(2018, 6, number, 12, 30),
+            datetime.time(number, 15)])
+    sheet["G3"] = datetime.date(2018, 6, 1)
+    sheet["H4"] = datetime.timedelta(hours=36)
+    sheet["H4"].number_format = "[h]:mm:ss"
+    sheet["A25"] = "=SUM(B2:B21)"
+
+    sparse = wb.create_sheet("Sparse")
+    sparse["C3"] = "middle"
+    sparse["A10"] = True
+    sparse["F7"] = 1e-20
+    sparse["B12"] = -3
+
+    wb.create_sheet("Empty")
+
+    workbook = tmp_path / "mixed.xlsx"
+    wb.save(workbook)
+
+    return workbook
+
+
+def test_mixed_types(mixed_workbook):
+    expected, fast = read_both(mixed_workbook)
+
+    assert fast == expected
+    assert fast[0][1][1][3] is False
+    assert fast[0][1][1][4] == datetime.datetime(2018, 6, 1, 12, 30)
+
+
+def test_sparse_rows(mixed_workbook):
+    expected, fast = read_both(mixed_workbook)
+    rows = dict(fast)["Sparse"]
+
+    assert fast == expected
+    assert len(rows) == 12
+    assert rows[0] == (None,) * 6
+    assert rows[2][2] == "middle"
+
+
+def test_mac_epoch(tmp_path):
+    wb = openpyxl.Workbook()
+    wb.epoch = openpyxl.utils.datetime.CALENDAR_MAC_1904
+    wb.active.append([datetime.datetime(2018, 6, 1), 1.5])
+    workbook = tmp_path / "mac.xlsx"
+    wb.save(workbook)
+
+    expected, fast = read_both(workbook)
+
+    assert fast == expected
+    assert fast[0][1][0][0] == datetime.datetime(2018, 6, 1)
+
+
+def test_inline_strings_and_shared_formulas(tmp_path):
+    wb = openpyxl.Workbook()
+    wb.active["A1"] = "placeholder"
+    workbook = tmp_path / "patched.xlsx"
+    wb.save(workbook)
+    patch_sheet(workbook, "xl/worksheets/sheet1.xml", "A1:C4", PATCHED_ROWS)
+
+    expected, fast = read_both(workbook)
+    rows = fast[0][1]
+
+    assert fast == expected
+    assert rows[0][:2] == ("inline", "=C1*2")
+    assert rows[1][:2] == ("rich text", "=C2*2")
+    assert rows[2] == (None, None, None)
+    assert rows[3][1] == "=SUM(C1:C2)"
+
+
+def test_check_fast_path(mixed_workbook):
+    assert check_fast_path(mixed_workbook)
@@ -14,48 +14,180 @@
 # 
 # Nadia Borsch      misc@nborsch.com        Jun/2018
 
-import openpyxl, os
-
-print(f"\n{'Text Files to Spreadsheet':>40}")
-print(f"{'~~~~ ~~~~~ ~~ ~~~~~~~~~~~':>40}")
-
-# Get folder path from user
-print(f"\nCurrent working directory is {os.getcwd()}:")
-path = input("Please enter the desired folder path or leave blank to stay in current working directory.\n")
-if path:
-    os.chdir(path)
-
-print(f"\nAll plain text files in {os.getcwd()} will be converted to a spreadsheet.")
-
-# Set up workbook/worksheet
-wb = openpyxl.Workbook()
-sheet = wb.active
-
-for foldername, subfolders, filenames in os.walk(path):
-    for column, filename in enumerate(filenames, 1):
-        print(f"Saving {filename} to spreadsheet...")
-
-        try:
-            txt_file = open(filename, "r")
-        except IOError:
-            print(f"Could not open {filename}.")
-            continue
-        
-        try:
-            lines = txt_file.readlines()
-        except UnicodeDecodeError:
-            print(f"{filename} is not a plain text file, skipped...")
-            continue
-
-        for row, line in enumerate(lines, 1):
-            sheet.cell(column=column, row=row).value = line.strip("\n")
-
-        txt_file.close()
-
-# Save and close workbook
-try:
-    wb.save("txt2spreadsheet.xlsx")
-except PermissionError:
-    print("Could not save spreadsheet, please try again.")
-
-print("Done.")
+import contextlib
+import os
+
+import openpyxl
+
+from spreadsheetIO import MAX_COLUMNS
+from spreadsheetIO import append_rows
+from spreadsheetIO import open_file_limit
+from spreadsheetIO import save_workbook
+
+# Constants
+SPREADSHEET_FILE = "txt2spreadsheet.xlsx"
+# Characters read from each file to check it's plain text
+PROBE_SIZE = 8192
+# Lines of the files past the open file limit held in memory at a time
+SPILL_BLOCK_CELLS = 2 ** 20
+
+
+def list_text_files(path):
+    """
+    Lists the plain text files in a folder and all its subfolders, in a
+    stable order, giving each file its own column across the whole tree.
+    A file is taken as plain text if its start can be decoded and holds no
+    NUL characters. Takes in the folder path and returns the list of file
+    paths, one per column.
+    """
+
+    text_files = []
+
+    for foldername, subfolders, filenames in os.walk(path):
+        subfolders.sort()
+
+        for filename in sorted(filenames):
+            txt_path = os.path.join(foldername, filename)
+
+            try:
+                with open(txt_path, "r") as txt_file:
+                    probe = txt_file.read(PROBE_SIZE)
+            except UnicodeDecodeError:
+                print(f"{filename} is not a plain text file, skipped...")
+                continue
+            except IOError:
+                print(f"Could not open {filename}.")
+                continue
+
+            if "\0" in probe:
+                print(f"{filename} is not a plain text file, skipped...")
+                continue
+
+            text_files.append(txt_path)
+
+    return text_files
+
+
+def read_lines(txt_path, position, count):
+    """
+    Reads the next lines of a text file that isn't kept open, so it's
+    opened again where the last read stopped. Takes in the file path, the
+    position returned by the last read (0 at first) and the number of
+    lines to read, and returns a tuple with the list of lines and the
+    position after them.
+    """
+
+    # Undecodable bytes past the probed start are replaced
+    with open(txt_path, "r", errors="replace") as txt_file:
+        txt_file.seek(position)
+        lines = []
+
+        for _ in range(count):
+            line = txt_file.readline()
+            if not line:
+                break
+            lines.append(line)
+
+        return lines, txt_file.tell()
+
+
+def iter_text_rows(text_files, open_files=None, block_cells=SPILL_BLOCK_CELLS):
+    """
+    Reads the lines of several text files side by side, holding a single
+    line of each file in memory at a time. Files past the open file limit
+    are read a block of lines at a time instead, opening them once per
+    block. Takes in the list of file paths, the number of files to keep open
+    (from the open file limit if None) and the number of lines of the other
+    files held in memory, and yields tuples with the next line of each
+    file, or None for files that have run out of lines.
+    """
+
+    if open_files is None:
+        open_files = open_file_limit()
+
+    spilled = text_files[open_files:]
+    positions = [0] * len(spilled)
+    block_lines = max(1, block_cells // (len(spilled) or 1))
+
+    with contextlib.ExitStack() as stack:
+        # Undecodable bytes past the probed start are replaced
+        txt_files = [
+            stack.enter_context(open(txt_path, "r", errors="replace"))
+            for txt_path in text_files[:open_files]
+            ]
+
+        while True:
+            blocks = []
+            for index, txt_path in enumerate(spilled):
+                lines, positions[index] = read_lines(
+                    txt_path, positions[index], block_lines)
+                blocks.append(lines)
+
+            for line_number in range(block_lines):
+                # Files that have run out of lines return ""
+                lines = [txt_file.readline() for txt_file in txt_files] + [
+                    lines[line_number] if line_number < len(lines) else ""
+                    for lines in blocks
+                    ]
+
+                if not any(lines):
+                    return
+
+                yield tuple(
+                    line.strip("\n") if line else None for line in lines)
+
+
+def text_to_spreadsheet(path, spreadsheet_file=SPREADSHEET_FILE):
+    """
+    Writes the lines of every text file in a folder tree to a spreadsheet,
+    one file per column and one line per row. Rows are streamed into a
+    write-only workbook as they are read, so memory use follows the size of
+    a row rather than the size of the files. Takes in the folder path and
+    the spreadsheet path, and returns the number of files written.
+    """
+
+    text_files = list_text_files(path)
+
+    if len(text_files) > MAX_COLUMNS:
+        raise ValueError(
+            f"found {len(text_files)} text files, a spreadsheet only has "
+            f"{MAX_COLUMNS} columns")
+
+    # Set up workbook/worksheet
+    wb = openpyxl.Workbook(write_only=True)
+    sheet = wb.create_sheet()
+
+    for txt_path in text_files:
+        print(f"Saving {txt_path} to spreadsheet...")
+
+    append_rows(sheet, iter_text_rows(text_files))
+    save_workbook(wb, spreadsheet_file)
+
+    return len(text_files)
+
+
+def main():
+    print(f"\n{'Text Files to Spreadsheet':>40}")
+    print(f"{'~~~~ ~~~~~ ~~ ~~~~~~~~~~~':>40}")
+
+    # Get folder path from user
+    print(f"\nCurrent working directory is {os.getcwd()}:")
+    path = input("Please enter the desired folder path or leave blank to stay in current working directory.\n")
+    if path:
+        os.chdir(path)
+
+    print(f"\nAll plain text files in {os.getcwd()} will be converted to a spreadsheet.")
+
+    # Save and close workbook
+    try:
+        text_to_spreadsheet(".")
+    except PermissionError:
+        print("Could not save spreadsheet, please try again.")
+    except (OSError, ValueError) as error:
+        print(f"Could not create spreadsheet: {error}.")
+
+    print("Done.")
+
+
+if __name__ == '__main__':
+    main()